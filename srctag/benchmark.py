@@ -0,0 +1,174 @@
+"""
+reproducible benchmark on synthetic repositories
+
+    srctag benchmark --output baseline.json
+    srctag benchmark --baseline baseline.json
+
+repos are generated locally with `git fast-import` and embedded with a deterministic hash embedder,
+so results do not depend on network, models or GPUs.
+"""
+import hashlib
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import typing
+import uuid
+
+import numpy as np
+from pydantic_settings import BaseSettings
+
+from srctag.collector import Collector, ScanRuleEnum
+from srctag.embedding import EmbeddingFunction
+from srctag.profile import Profile, get_peak_rss
+from srctag.storage import Storage, StorageConfig, MetadataConstant
+from srctag.tagger import Tagger
+
+WORDS = [
+    "fix", "add", "remove", "refactor", "update", "support", "cache", "parser", "network", "storage",
+    "config", "test", "docs", "error", "timeout", "retry", "auth", "login", "search", "index",
+    "query", "render", "layout", "theme", "upload", "download", "stream", "buffer", "memory", "thread",
+]
+
+
+class BenchmarkConfig(BaseSettings):
+    file_count: int = 200
+    dir_count: int = 10
+    commit_count: int = 1000
+    files_per_commit: int = 3
+    # probability of a commit message referring to an issue
+    issue_density: float = 0.3
+    issue_count: int = 100
+
+    tag_count: int = 10
+    # -1 for whole history
+    max_depth_limit: int = -1
+    seed: int = 42
+
+
+class HashEmbeddingFunction(EmbeddingFunction):
+    """ deterministic stub embedder, hashed bag of words """
+
+    def __init__(self, dim: int = 64):
+        self.dim = dim
+
+    def __call__(self, input: typing.List[str]) -> typing.List[typing.List[float]]:
+        ret = []
+        for each in input:
+            vec = np.zeros(self.dim)
+            for word in each.lower().split():
+                h = int(hashlib.md5(word.encode()).hexdigest(), 16)
+                vec[h % self.dim] += 1.0 if (h >> 64) % 2 else -1.0
+            norm = np.linalg.norm(vec)
+            if norm:
+                vec = vec / norm
+            ret.append(vec.tolist())
+        return ret
+
+
+def generate_repo(repo_root: str, config: BenchmarkConfig):
+    """ generate a synthetic git repo with fast-import """
+    rand = random.Random(config.seed)
+    files = [f"dir_{i % config.dir_count}/file_{i}.py" for i in range(config.file_count)]
+
+    subprocess.check_call(["git", "init", "-q", repo_root])
+    base_time = 1600000000
+    chunks = []
+    for i in range(config.commit_count):
+        msg = " ".join(rand.choice(WORDS) for _ in range(rand.randint(3, 10)))
+        if rand.random() < config.issue_density:
+            msg += f" (#{rand.randint(1, config.issue_count)})"
+        msg = msg.encode()
+
+        chunks.append(b"commit refs/heads/main\n")
+        chunks.append(f"committer bench <bench@srctag> {base_time + i * 3600} +0000\n".encode())
+        chunks.append(f"data {len(msg)}\n".encode() + msg + b"\n")
+
+        touched = files if i == 0 else rand.sample(files, min(config.files_per_commit, len(files)))
+        for each_file in touched:
+            content = f"# {each_file} rev {i}\n".encode()
+            chunks.append(f"M 644 inline {each_file}\ndata {len(content)}\n".encode() + content + b"\n")
+        chunks.append(b"\n")
+
+    subprocess.run(["git", "fast-import", "--quiet"], input=b"".join(chunks), cwd=repo_root, check=True)
+    subprocess.check_call(["git", "checkout", "-q", "main"], cwd=repo_root)
+
+
+def _stage_result(profile: Profile, wall_time: float, items: int) -> typing.Dict[str, typing.Any]:
+    return {
+        "wall_time": wall_time,
+        "items": items,
+        "throughput": items / wall_time if wall_time else 0.0,
+        # process-wide high-water mark so far, see stages for the growth of each stage
+        "peak_rss": get_peak_rss(),
+        "stages": profile.to_dict(),
+    }
+
+
+def run_benchmark(config: BenchmarkConfig = None, repo_root: str = "") -> typing.Dict[str, typing.Any]:
+    if not config:
+        config = BenchmarkConfig()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if not repo_root:
+            repo_root = os.path.join(tmp_dir, "repo")
+            generate_repo(repo_root, config)
+
+        results = dict()
+        ctx = None
+        for each_rule in (ScanRuleEnum.DFS, ScanRuleEnum.BFS):
+            collector = Collector()
+            collector.config.repo_root = repo_root
+            collector.config.scan_rule = each_rule
+            collector.config.max_depth_limit = config.max_depth_limit
+
+            start = time.perf_counter()
+            ctx = collector.collect_metadata()
+            cost = time.perf_counter() - start
+            commits = sum(len(each.commits) for each in ctx.files.values())
+            results[f"collect_{each_rule.value.lower()}"] = _stage_result(ctx.profile, cost, commits)
+
+        storage_config = StorageConfig(
+            # in-memory chroma is shared inside the process
+            collection_name=f"benchmark_{uuid.uuid4().hex}",
+            data_types={MetadataConstant.DATA_TYPE_COMMIT_MSG},
+        )
+        storage = Storage(storage_config, embedding_function=HashEmbeddingFunction())
+        start = time.perf_counter()
+        storage.embed_ctx(ctx)
+        cost = time.perf_counter() - start
+        results["embed"] = _stage_result(storage.profile, cost, storage.chromadb_collection.count())
+
+        tagger = Tagger()
+        tagger.config.tags = set(WORDS[:config.tag_count])
+        storage.profile = Profile()
+        start = time.perf_counter()
+        tag_result = tagger.tag(storage)
+        cost = time.perf_counter() - start
+        results["tag"] = _stage_result(tag_result.profile, cost, len(tagger.config.tags))
+
+    return {
+        "config": config.model_dump(),
+        "env": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def compare(current: typing.Dict[str, typing.Any], baseline: typing.Dict[str, typing.Any],
+            tolerance: float = 0.2) -> typing.List[str]:
+    """ returns regressions, a stage regresses when its throughput drops more than tolerance """
+    regressions = []
+    for name, each in baseline["results"].items():
+        if name not in current["results"]:
+            continue
+        expected = each["throughput"]
+        actual = current["results"][name]["throughput"]
+        if expected and actual < expected * (1 - tolerance):
+            regressions.append(f"{name}: throughput {actual:.2f} < baseline {expected:.2f}")
+    return regressions
+
@@ -0,0 +1,54 @@
+import os
+import sqlite3
+import typing
+
+
+class CheckpointJournal(object):
+    """
+    files and docs already written to storage, in a sqlite file next to db_path.
+    an interrupted embedding run resumes from it, and it will be removed after the run finished.
+    """
+
+    FILE_NAME = "srctag-checkpoint.db"
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY);
+        """)
+
+    @classmethod
+    def path_of(cls, db_path: str, repo_name: str = "") -> str:
+        if not db_path:
+            # in-memory only
+            return ""
+        if repo_name:
+            # repos sharing one db_path
+            return os.path.join(db_path, cls.FILE_NAME.replace(".db", f"-{repo_name}.db"))
+        return os.path.join(db_path, cls.FILE_NAME)
+
+    def has_file(self, name: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM files WHERE name = ?", (name,)).fetchone() is not None
+
+    def has_doc(self, doc_id: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM docs WHERE id = ?", (doc_id,)).fetchone() is not None
+
+    def file_count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def commit(self, files: typing.Iterable[str], doc_ids: typing.Iterable[str]):
+        """ call it after the docs are written """
+        self.conn.executemany("INSERT OR IGNORE INTO docs VALUES (?)", ((each,) for each in doc_ids))
+        self.conn.executemany("INSERT OR IGNORE INTO files VALUES (?)", ((each,) for each in files))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def remove(self):
+        self.close()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
@@ -1,15 +1,19 @@
+import json
+import os
 import subprocess
 import typing
 
-import chromadb
 import click
 import networkx
 import networkx as nx
-from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
 from loguru import logger
 
-from srctag.collector import Collector, FileLevelEnum
-from srctag.storage import Storage, MetadataConstant
+from srctag.benchmark import BenchmarkConfig, run_benchmark, compare
+from srctag.cochange import CoChangeMatrix
+from srctag.collector import Collector, FileLevelEnum, CollectorConfig
+from srctag.multi import MultiRepoTagger
+from srctag.snapshot import save_snapshot, snapshot_path
+from srctag.storage import Storage, StorageConfig, MetadataConstant, StorageBackendEnum
 from srctag.tagger import Tagger
 
 
@@ -19,21 +23,22 @@ def cli():
 
 
 @cli.command()
-def prepare():
-    """ usually used for pre-downloading sentence-transformer models """
+@click.option("--st-model", default="", help="Sentence Transformer Model")
+@click.option("--model-cache-dir", default="", help="Dir for local model snapshots, default to ~/.cache/srctag/models")
+def prepare(st_model, model_cache_dir):
+    """ pre-download sentence-transformer models, and save them as fast-load local snapshots """
+    config = StorageConfig()
+    if st_model:
+        config.st_model_name = st_model
+    config.model_cache_dir = model_cache_dir
 
     logger.info("Start checking env. It may takes a few minutes for downloading models ...")
-    # try to embed
-    chromadb_cli = chromadb.Client()
-    collection = chromadb_cli.get_or_create_collection(
-        "testonly",
-        embedding_function=SentenceTransformerEmbeddingFunction(),
-    )
-    collection.add(
-        documents=["doc"],
-        ids=["id"],
-    )
-    assert collection.count() == 1
+    save_snapshot(config.st_model_name, snapshot_path(config.st_model_name, config.model_cache_dir))
+
+    # try to embed, with the snapshot
+    storage = Storage(config)
+    storage.init_embedding_function()
+    assert len(storage.embedding_function(["doc"])) == 1
     click.echo("ok.")
 
 
@@ -45,34 +50,95 @@ def prepare():
 @click.option("--output-path", default="", help="Output file path for CSV")
 @click.option("--file-level", default=FileLevelEnum.FILE.value, help="Scan file level, FILE or DIR, default to FILE")
 @click.option("--st-model", default="", help="Sentence Transformer Model")
-@click.option("--commit-include-regex", default="", help="Commit message include regex pattern")
-def tag(repo_root, max_depth_limit, include_regex, tags_file, output_path, file_level, st_model, commit_include_regex):
+@click.option("--commit-include-regex", default="",
+              help="Commit message include regex (python re, matched from the start)")
+@click.option("--since", default="", help="Only use commits more recent than a specific date")
+@click.option("--until", default="", help="Only use commits older than a specific date")
+@click.option("--profile", default="", help="Output file path for per-stage timing report (JSON)")
+@click.option("--include-pattern", multiple=True, help="File include glob pattern, can be used many times")
+@click.option("--exclude-pattern", multiple=True, help="File exclude glob pattern, can be used many times")
+@click.option("--pattern-file", default="", help="CODEOWNERS-like file containing include/exclude patterns")
+@click.option("--backend", default=StorageBackendEnum.CHROMA.value, help="Vector storage backend, CHROMA or NUMPY")
+@click.option("--db-path", default="", help="Persist storage here, for reusing it in later runs")
+@click.option("--files", multiple=True,
+              help="Only tag these files with the existing storage in --db-path, can be used many times")
+def tag(repo_root, max_depth_limit, include_regex, tags_file, output_path, file_level, st_model, commit_include_regex,
+        since, until, profile, include_pattern, exclude_pattern, pattern_file, backend, db_path, files):
     """ tag your repo """
-    collector = Collector()
-    collector.config.repo_root = repo_root
-    collector.config.max_depth_limit = max_depth_limit
-    collector.config.include_regex = include_regex
-    collector.config.file_level = file_level
-    collector.config.commit_include_regex = commit_include_regex
+    assert tags_file, "no tag file provided"
+    tags = [each.strip() for each in tags_file.read().splitlines()]
+    tagger = Tagger()
+    tagger.config.tags = tags
 
-    ctx = collector.collect_metadata()
     storage = Storage()
+    storage.config.backend = backend
+    storage.config.db_path = db_path
     if st_model:
         storage.config.st_model_name = st_model
-    storage.embed_ctx(ctx)
-    tagger = Tagger()
 
-    assert tags_file, "no tag file provided"
-    tags = [each.strip() for each in tags_file.read().splitlines()]
+    if files:
+        # no collecting and embedding, reuse the storage
+        assert db_path, "--files requires an existing storage in --db-path"
+        tag_dict = tagger.tag_files(storage, files)
+    else:
+        collector = Collector()
+        collector.config.repo_root = repo_root
+        collector.config.max_depth_limit = max_depth_limit
+        collector.config.include_regex = include_regex
+        collector.config.file_level = file_level
+        collector.config.commit_include_regex = commit_include_regex
+        collector.config.since = since
+        collector.config.until = until
+        collector.config.include_patterns = list(include_pattern)
+        collector.config.exclude_patterns = list(exclude_pattern)
+        collector.config.pattern_file = pattern_file
 
-    tagger.config.tags = tags
-    tag_dict = tagger.tag(storage)
+        ctx = collector.collect_metadata()
+        storage.embed_ctx(ctx)
+        tag_dict = tagger.tag(storage)
+        ctx.close()
 
     if output_path:
         tag_dict.export_csv(path=output_path)
     else:
         tag_dict.export_csv()
 
+    if profile:
+        tag_dict.profile.export_json(profile)
+
+
+@cli.command()
+@click.option("--repo-root", multiple=True, required=True, help="Repository root directory, can be used many times")
+@click.option("--max-depth-limit", default=-1, help="Maximum depth limit")
+@click.option("--include-regex", default="", help="File include regex pattern")
+@click.option("--tags-file", type=click.File("r"), default="./srctag.txt", help="Path to a text file containing tags")
+@click.option("--output-dir", default=".", help="Output dir for CSV files, one file per repo")
+@click.option("--combined", is_flag=True, help="Output one combined CSV instead")
+@click.option("--file-level", default=FileLevelEnum.FILE.value, help="Scan file level, FILE or DIR, default to FILE")
+@click.option("--st-model", default="", help="Sentence Transformer Model")
+@click.option("--workers", default=4, help="Worker count for collecting repos")
+def tag_repos(repo_root, max_depth_limit, include_regex, tags_file, output_dir, combined, file_level, st_model,
+              workers):
+    """ tag multiple repos with a shared model and index """
+    collector_config = CollectorConfig()
+    collector_config.max_depth_limit = max_depth_limit
+    collector_config.include_regex = include_regex
+    collector_config.file_level = file_level
+
+    multi_tagger = MultiRepoTagger(collector_config=collector_config, workers=workers)
+    if st_model:
+        multi_tagger.storage.config.st_model_name = st_model
+
+    assert tags_file, "no tag file provided"
+    multi_tagger.tagger.config.tags = [each.strip() for each in tags_file.read().splitlines()]
+
+    results = multi_tagger.tag(list(repo_root))
+    if combined:
+        MultiRepoTagger.combine(results).export_csv(os.path.join(output_dir, "srctag-output.csv"))
+    else:
+        for each_name, each_result in results.items():
+            each_result.export_csv(os.path.join(output_dir, f"srctag-output-{each_name}.csv"))
+
 
 @cli.command()
 @click.option("--repo-root", default=".", help="Repository root directory")
@@ -81,7 +147,9 @@ def tag(repo_root, max_depth_limit, include_regex, tags_file, output_path, file_
 @click.option("--file-level", default=FileLevelEnum.FILE.value, help="Scan file level, FILE or DIR, default to FILE")
 @click.option("--output-path", default="srctag.dot", help="Output file path for DOT")
 @click.option("--issue-regex", default="", help="Issue regex")
-def graph(repo_root, max_depth_limit, include_regex, file_level, output_path, issue_regex):
+@click.option("--top-k", default=0, help="Only keep the top k co-change files of each file, 0 for the whole graph")
+@click.option("--half-life-days", default=0.0, help="Decay co-change weights by commit age, 0 for no decay")
+def graph(repo_root, max_depth_limit, include_regex, file_level, output_path, issue_regex, top_k, half_life_days):
     """ create relations graph from your repo """
     collector = Collector()
     collector.config.repo_root = repo_root
@@ -93,6 +161,11 @@ def graph(repo_root, max_depth_limit, include_regex, file_level, output_path, is
 
     ctx = collector.collect_metadata()
     relation_graph = ctx.relations
+    if top_k > 0:
+        relation_graph = CoChangeMatrix.from_relations(
+            relation_graph, half_life_days, spilled=ctx.spilled_relations
+        ).to_networkx(top_k)
+    ctx.close()
     render_dot(relation_graph, output_path)
 
 
@@ -104,7 +177,9 @@ def graph(repo_root, max_depth_limit, include_regex, file_level, output_path, is
 @click.option("--output-path", default="srctag.dot", help="Output file path for DOT")
 @click.option("--batch", default=1, help="")
 @click.option("--issue-regex", default="", help="Issue regex")
-def diff(repo_root, max_depth_limit, diff_target, file_level, output_path, batch, issue_regex):
+@click.option("--top-k", default=0, help="Expand each file with its top k co-change files, 0 for all the issue neighbors")
+@click.option("--half-life-days", default=0.0, help="Decay co-change weights by commit age, 0 for no decay")
+def diff(repo_root, max_depth_limit, diff_target, file_level, output_path, batch, issue_regex, top_k, half_life_days):
     """ create relations graph from your repo, with diff """
     base_file_set = get_git_diff_files(diff_target)
     total_file_set = base_file_set
@@ -123,24 +198,31 @@ def diff(repo_root, max_depth_limit, diff_target, file_level, output_path, batch
 
         # enlarge this file set
         file_set = set(ctx.files.keys())
-        # network graph
-        for each in file_set:
-            if not ctx.relations.has_node(each):
-                logger.warning(f"node {each} not in graph")
-                continue
-
-            issues = set()
-            for each_node in ctx.relations.neighbors(each):
-                if ctx.relations.nodes[each_node]["node_type"] != MetadataConstant.KEY_ISSUE_ID:
+        if top_k > 0:
+            # the strongest relations only
+            cochange = CoChangeMatrix.from_relations(ctx.relations, half_life_days, spilled=ctx.spilled_relations)
+            for each in ctx.files.keys():
+                file_set.update(each_neighbor for each_neighbor, _ in cochange.top_k_neighbors(each, top_k))
+        else:
+            # network graph
+            for each in set(file_set):
+                if not ctx.relations.has_node(each):
+                    logger.warning(f"node {each} not in graph")
                     continue
-                issues.add(each_node)
-            # END issue query
 
-            for each_issue in issues:
-                related_files = ctx.relations.neighbors(each_issue)
-                file_set = file_set.union(related_files)
+                issues = set()
+                for each_node in ctx.relations.neighbors(each):
+                    if ctx.relations.nodes[each_node]["node_type"] != MetadataConstant.KEY_ISSUE_ID:
+                        continue
+                    issues.add(each_node)
+                # END issue query
+
+                for each_issue in issues:
+                    related_files = ctx.relations.neighbors(each_issue)
+                    file_set = file_set.union(related_files)
 
         # END file query
+        ctx.close()
 
         logger.info(f"batch {i} end, files: {len(base_file_set)} -> {len(file_set)}")
         new_file_set = file_set - total_file_set
@@ -160,10 +242,44 @@ def diff(repo_root, max_depth_limit, diff_target, file_level, output_path, batch
     if issue_regex:
         collector.config.issue_regex = issue_regex
     ctx = collector.collect_metadata()
+    ctx.close()
     relation_graph = ctx.relations
     render_dot(relation_graph, output_path)
 
 
+@cli.command()
+@click.option("--file-count", default=200, help="Files in synthetic repo")
+@click.option("--commit-count", default=1000, help="Commits in synthetic repo")
+@click.option("--files-per-commit", default=3, help="Files changed by each commit")
+@click.option("--issue-density", default=0.3, help="Probability of a commit referring to an issue")
+@click.option("--output", default="", help="Output file path for benchmark result (JSON)")
+@click.option("--baseline", default="", help="Baseline result (JSON) for regression check")
+@click.option("--tolerance", default=0.2, help="Allowed throughput drop compared with baseline")
+def benchmark(file_count, commit_count, files_per_commit, issue_density, output, baseline, tolerance):
+    """ run benchmark on a synthetic repo """
+    config = BenchmarkConfig(
+        file_count=file_count,
+        commit_count=commit_count,
+        files_per_commit=files_per_commit,
+        issue_density=issue_density,
+    )
+    result = run_benchmark(config)
+    content = json.dumps(result, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(content)
+    else:
+        click.echo(content)
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(result, json.load(f), tolerance)
+        for each in regressions:
+            logger.error(each)
+        if regressions:
+            raise click.ClickException(f"{len(regressions)} regressions found")
+
+
 def get_git_diff_files(target: str) -> typing.Set[str]:
     result = subprocess.check_output(['git', 'diff', target, '--name-only'], text=True)
     diff_files = result.splitlines()
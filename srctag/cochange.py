@@ -0,0 +1,123 @@
+import typing
+
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+
+from srctag.storage import MetadataConstant
+
+if typing.TYPE_CHECKING:
+    from srctag.spill import SpilledRelations
+
+
+class CoChangeMatrix(object):
+    """
+    co-change weights between files, from the file x (commit + issue) incidence of relation graph
+
+    weight(a, b) = sum of the weights of commits and issues shared by a and b
+    - commit weight: 1.0, or decayed by commit age with a half life
+    - issue weight: issue_weight
+    """
+
+    def __init__(self, files: typing.List[str], matrix: sp.csr_matrix):
+        self.files = files
+        self.index: typing.Dict[str, int] = {each: i for i, each in enumerate(files)}
+        self.matrix = matrix
+
+    @classmethod
+    def from_relations(cls,
+                       relations: nx.Graph,
+                       half_life_days: float = 0.0,
+                       issue_weight: float = 1.0,
+                       spilled: "SpilledRelations" = None) -> "CoChangeMatrix":
+        """ commits and issues are read from spilled (streamed from the spill store) if set, or relations """
+        node_types = relations.nodes(data="node_type")
+        files = [each for each, node_type in node_types if node_type == MetadataConstant.KEY_SOURCE]
+        file_index = {each: i for i, each in enumerate(files)}
+
+        if spilled:
+            rows, cols, event_types, event_timestamps = cls._incidence_from_spilled(spilled, file_index)
+        else:
+            rows, cols, event_types, event_timestamps = cls._incidence_from_graph(relations, file_index)
+
+        # event weights
+        is_commit = np.array([each == MetadataConstant.KEY_COMMIT_SHA for each in event_types], dtype=bool)
+        weights = np.where(is_commit, 1.0, issue_weight)
+        if half_life_days > 0 and is_commit.any():
+            timestamps = np.array(event_timestamps, dtype=float)[is_commit]
+            age_days = (timestamps.max() - timestamps) / 86400.0
+            weights[is_commit] *= np.power(0.5, age_days / half_life_days)
+
+        incidence = sp.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(len(files), len(event_types))
+        )
+        # duplicated edges can not exist in nx.Graph, but keep it binary anyway
+        incidence.data[:] = 1.0
+
+        matrix = (incidence @ sp.diags(weights) @ incidence.T).tocsr()
+        matrix.setdiag(0)
+        matrix.eliminate_zeros()
+        return cls(files, matrix)
+
+    @staticmethod
+    def _incidence_from_graph(relations: nx.Graph, file_index: typing.Dict[str, int]):
+        node_types = relations.nodes(data="node_type")
+        events = [
+            each for each, node_type in node_types
+            if node_type in (MetadataConstant.KEY_COMMIT_SHA, MetadataConstant.KEY_ISSUE_ID)
+        ]
+        event_index = {each: i for i, each in enumerate(events)}
+        event_types = [node_types[each] for each in events]
+        event_timestamps = [relations.nodes[each].get("timestamp", 0) for each in events]
+
+        rows, cols = [], []
+        for u, v in relations.edges():
+            if u in file_index and v in event_index:
+                rows.append(file_index[u])
+                cols.append(event_index[v])
+            elif v in file_index and u in event_index:
+                rows.append(file_index[v])
+                cols.append(event_index[u])
+        return rows, cols, event_types, event_timestamps
+
+    @staticmethod
+    def _incidence_from_spilled(spilled: "SpilledRelations", file_index: typing.Dict[str, int]):
+        # edges come grouped by event, no event index needed
+        rows, cols, event_types, event_timestamps = [], [], [], []
+        last_event = None
+        for event, node_type, timestamp, each_file in spilled.edges():
+            if event != last_event:
+                last_event = event
+                event_types.append(node_type)
+                event_timestamps.append(timestamp or 0)
+            if each_file in file_index:
+                rows.append(file_index[each_file])
+                cols.append(len(event_types) - 1)
+        return rows, cols, event_types, event_timestamps
+
+    def weight(self, file_a: str, file_b: str) -> float:
+        if file_a not in self.index or file_b not in self.index:
+            return 0.0
+        return float(self.matrix[self.index[file_a], self.index[file_b]])
+
+    def top_k_neighbors(self, file_name: str, k: int) -> typing.List[typing.Tuple[str, float]]:
+        """ the k files most frequently changed together with this file """
+        if file_name not in self.index:
+            return []
+        row = self.matrix.getrow(self.index[file_name])
+        if not row.nnz:
+            return []
+
+        k = min(k, row.nnz)
+        top = np.argpartition(-row.data, k - 1)[:k]
+        top = top[np.argsort(-row.data[top], kind="stable")]
+        return [(self.files[row.indices[i]], float(row.data[i])) for i in top]
+
+    def to_networkx(self, k: int) -> nx.Graph:
+        """ file graph with the top k co-change edges of each file """
+        g = nx.Graph()
+        for each_file in self.files:
+            g.add_node(each_file, node_type=MetadataConstant.KEY_SOURCE)
+            for each_neighbor, each_weight in self.top_k_neighbors(each_file, k):
+                g.add_edge(each_file, each_neighbor, weight=each_weight)
+        return g
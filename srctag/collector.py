@@ -1,7 +1,10 @@
-import functools
 import os
 import re
+import struct
+import subprocess
+import time
 import typing
+from collections import OrderedDict
 from enum import Enum
 
 import git
@@ -11,6 +14,9 @@ from pydantic_settings import BaseSettings
 from tqdm import tqdm
 
 from srctag.model import FileContext, RuntimeContext, SrcTagException
+from srctag.pathfilter import PathFilter
+from srctag.spill import SpillStore, SpilledFileContext, SpilledRelations
+from srctag.profile import Profile, ProfileStage
 from srctag.storage import MetadataConstant
 
 
@@ -31,27 +37,187 @@ class CollectorConfig(BaseSettings):
     include_regex: str = ""
     include_file_list: typing.List[str] = []
 
-    # commit msg include regex
+    # gitignore / CODEOWNERS style patterns, see srctag.pathfilter
+    include_patterns: typing.List[str] = []
+    exclude_patterns: typing.List[str] = []
+    # CODEOWNERS-like file, the first column of each line is a pattern, `!` prefix for excluding
+    pattern_file: str = ""
+
+    # commit msg include regex (python re, matched from the start), in both DFS and BFS
     commit_include_regex: str = ""
 
     # set -1 to break the limit
     max_depth_limit: int = 16
+
+    # time window of histories, anything `git log --since/--until` accepts
+    # eg: "2023-01-01", "6 months ago"
+    since: str = ""
+    until: str = ""
     file_level: FileLevelEnum = FileLevelEnum.FILE
 
+    # only works with DIR level
+    # -1: parent dir of each file
+    # N: the first N path components, eg: 1 == top level dirs
+    dir_depth: int = -1
+
     # DFS: git log
     # BFS: walk the commits and get each diff files
     scan_rule: ScanRuleEnum = ScanRuleEnum.DFS
 
+    # use commit-graph with changed-path bloom filters for speeding up DFS
+    # it will be generated if not existed
+    use_commit_graph: bool = False
+
+    # spill commits and file -> commit postings to a sqlite file, instead of keeping them in memory
+    # for huge histories
+    spill_path: str = ""
+    # LRU cache size of commit messages and diffs in spill mode
+    spill_cache_size: int = 100000
+
     # issue regex for matching issue grammar
     # by default, we use GitHub standard
     issue_regex: str = r"(#\d+)"
 
 
+class GitBatchReader(object):
+    """
+    long-lived git coprocesses for reading commit objects by sha
+
+    - `git cat-file --batch` for commit messages
+    - `git diff-tree --stdin` for changed paths
+
+    all the requests go through a single pipe, instead of one round trip per commit.
+    """
+
+    # lines which are not commit ids will be echoed by diff-tree as is
+    DIFF_TREE_END_MARK = "srctag-diff-tree-end"
+
+    def __init__(self, repo_root: str, profile: Profile = None, cache_size: int = -1):
+        self.repo_root = repo_root
+        self.profile = profile or Profile()
+        self._cat_file: typing.Optional[subprocess.Popen] = None
+        self._diff_tree: typing.Optional[subprocess.Popen] = None
+
+        # sha -> content, LRU
+        # set -1 to break the limit
+        self.cache_size = cache_size
+        self._commits: typing.OrderedDict[str, typing.Tuple[str, int]] = OrderedDict()
+        self._changed_files: typing.OrderedDict[str, typing.Set[str]] = OrderedDict()
+
+    def _cache_get(self, cache: OrderedDict, sha: str) -> typing.Any:
+        if sha not in cache:
+            return None
+        cache.move_to_end(sha)
+        return cache[sha]
+
+    def _cache_put(self, cache: OrderedDict, sha: str, value: typing.Any):
+        cache[sha] = value
+        if self.cache_size != -1 and len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _start(self, args: typing.List[str]) -> subprocess.Popen:
+        return subprocess.Popen(
+            ["git", "-c", "core.quotePath=false", *args],
+            cwd=self.repo_root,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def read_object(self, sha: str) -> bytes:
+        if not self._cat_file:
+            self._cat_file = self._start(["cat-file", "--batch"])
+
+        self._cat_file.stdin.write(f"{sha}\n".encode())
+        self._cat_file.stdin.flush()
+
+        # <sha> <type> <size>
+        header = self._cat_file.stdout.readline().decode().split()
+        if len(header) != 3:
+            raise SrcTagException(f"failed to read object {sha}: {header}")
+        size = int(header[2])
+        content = self._cat_file.stdout.read(size)
+        # trailing LF
+        self._cat_file.stdout.read(1)
+        return content
+
+    def _read_commit(self, sha: str) -> typing.Tuple[str, int]:
+        cached = self._cache_get(self._commits, sha)
+        if cached is not None:
+            return cached
+
+        content = self.read_object(sha)
+        # headers end with the first empty line
+        headers, _, msg = content.partition(b"\n\n")
+        committed_time = 0
+        for each in headers.split(b"\n"):
+            # committer <name> <email> <timestamp> <tz>
+            if each.startswith(b"committer "):
+                committed_time = int(each.rsplit(b" ", 2)[1])
+                break
+        result = (msg.decode("utf-8", errors="replace"), committed_time)
+        self._cache_put(self._commits, sha, result)
+        return result
+
+    def message(self, sha: str) -> str:
+        return self._read_commit(sha)[0]
+
+    def commit_time(self, sha: str) -> int:
+        """ committed timestamp """
+        return self._read_commit(sha)[1]
+
+    def changed_files(self, sha: str) -> typing.Set[str]:
+        cached = self._cache_get(self._changed_files, sha)
+        if cached is not None:
+            return cached
+
+        with self.profile.stage(ProfileStage.DIFF_STATS, count=1):
+            result = self._read_changed_files(sha)
+        self._cache_put(self._changed_files, sha, result)
+        return result
+
+    def _read_changed_files(self, sha: str) -> typing.Set[str]:
+        if not self._diff_tree:
+            self._diff_tree = self._start([
+                "diff-tree", "--stdin", "-r", "--root", "--name-only", "--no-commit-id", "-m", "--first-parent",
+            ])
+
+        self._diff_tree.stdin.write(f"{sha}\n{self.DIFF_TREE_END_MARK}\n".encode())
+        self._diff_tree.stdin.flush()
+
+        result = set()
+        while True:
+            line = self._diff_tree.stdout.readline()
+            if not line:
+                raise SrcTagException(f"diff-tree exited unexpectedly: {sha}")
+            line = line.decode("utf-8", errors="replace").rstrip("\n")
+            if line == self.DIFF_TREE_END_MARK:
+                break
+            if line:
+                result.add(line)
+        return result
+
+    def close(self):
+        for each in (self._cat_file, self._diff_tree):
+            if each and each.poll() is None:
+                each.stdin.close()
+                each.wait()
+        self._cat_file = None
+        self._diff_tree = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except BaseException:
+            pass
+
+
 class Collector(object):
     def __init__(self, config: CollectorConfig = None):
         if not config:
             config = CollectorConfig()
         self.config = config
+        self.git_reader: typing.Optional[GitBatchReader] = None
+        self.path_filter: typing.Optional[PathFilter] = None
 
     def collect_metadata(self) -> RuntimeContext:
         exc = self._check_env()
@@ -60,22 +226,50 @@ class Collector(object):
 
         logger.info("git metadata collecting ...")
         ctx = RuntimeContext()
-        self._collect_files(ctx)
-
-        if self.config.scan_rule == ScanRuleEnum.DFS:
-            self._collect_histories(ctx)
-        else:
-            self._collect_histories_globally(ctx)
+        # shared by collector, relations and storage
+        cache_size = self.config.spill_cache_size if self.config.spill_path else -1
+        self.git_reader = GitBatchReader(self.config.repo_root, profile=ctx.profile, cache_size=cache_size)
+        ctx.git_reader = self.git_reader
+        if self.config.spill_path:
+            logger.info(f"spill mode, commits will be stored in {self.config.spill_path}")
+            ctx.spill_store = SpillStore(self.config.spill_path)
+            # one store per collection
+            ctx.spill_store.clear()
+            ctx.spilled_relations = SpilledRelations(ctx.spill_store)
+        self.path_filter = self._create_path_filter()
+
+        with ctx.profile.stage(ProfileStage.FILE_LISTING):
+            self._collect_files(ctx)
+        ctx.profile.add_count(ProfileStage.FILE_LISTING, len(ctx.files))
+
+        with ctx.profile.stage(ProfileStage.HISTORY_WALK):
+            if self.config.scan_rule == ScanRuleEnum.DFS:
+                if self.config.use_commit_graph:
+                    self._prepare_commit_graph()
+                self._collect_histories(ctx)
+            else:
+                self._collect_histories_globally(ctx)
+        ctx.profile.add_count(ProfileStage.HISTORY_WALK, sum(len(each.commits) for each in ctx.files.values()))
 
         # issue processing and network building
-        self._process_relations(ctx)
+        with ctx.profile.stage(ProfileStage.RELATION_BUILDING):
+            self._process_relations(ctx)
+        edge_count = ctx.relations.number_of_edges()
+        if ctx.spilled_relations:
+            edge_count += ctx.spilled_relations.number_of_edges()
+        ctx.profile.add_count(ProfileStage.RELATION_BUILDING, edge_count)
+
+        # histories of listed files collected at file level, and then aggregated into dirs
+        # entries of include_file_list are already nodes
+        if self.config.file_level == FileLevelEnum.DIR and not self.config.include_file_list:
+            ctx = ctx.roll_up(self.config.dir_depth)
+            logger.info(f"rolled up into {len(ctx.files)} dirs")
 
         logger.info("metadata ready")
         return ctx
 
-    @functools.lru_cache(maxsize=None)
     def _process_diff_from_commit(self, commit: Commit) -> typing.Set[str]:
-        return set(commit.stats.files.keys())
+        return self.git_reader.changed_files(commit.hexsha)
 
     def _process_relations(self, ctx: RuntimeContext):
         """
@@ -83,8 +277,11 @@ class Collector(object):
 
         1. files - issues
         2. files - commits
+
+        in spill mode, commits and issues with their edges go to the spill store
         """
         regex = re.compile(self.config.issue_regex)
+        events = ctx.spilled_relations or ctx.relations
 
         for each_file in tqdm(ctx.files.values()):
             ctx.relations.add_node(each_file.name, node_type=MetadataConstant.KEY_SOURCE)
@@ -92,23 +289,27 @@ class Collector(object):
             # and the related files
             for each_commit in each_file.commits:
                 related_files = self._process_diff_from_commit(each_commit)
-                ctx.relations.add_node(each_commit.hexsha, node_type=MetadataConstant.KEY_COMMIT_SHA)
-                ctx.relations.add_edge(each_commit.hexsha, each_file.name)
+                events.add_node(
+                    each_commit.hexsha,
+                    node_type=MetadataConstant.KEY_COMMIT_SHA,
+                    timestamp=ctx.commit_time(each_commit),
+                )
+                events.add_edge(each_commit.hexsha, each_file.name)
 
                 for each_related in related_files:
                     # commit -> related files
                     ctx.relations.add_node(each_related, node_type=MetadataConstant.KEY_SOURCE)
-                    ctx.relations.add_edge(each_commit.hexsha, each_related)
+                    events.add_edge(each_commit.hexsha, each_related)
                 # END commit -> file
 
-                issue_id_list = regex.findall(each_commit.message)
+                issue_id_list = regex.findall(ctx.commit_message(each_commit))
                 for each_issue in issue_id_list:
                     # issue -> file
-                    ctx.relations.add_node(each_issue, node_type=MetadataConstant.KEY_ISSUE_ID)
-                    ctx.relations.add_edge(each_issue, each_file.name)
+                    events.add_node(each_issue, node_type=MetadataConstant.KEY_ISSUE_ID)
+                    events.add_edge(each_issue, each_file.name)
 
                     for each_related in related_files:
-                        ctx.relations.add_edge(each_issue, each_related)
+                        events.add_edge(each_issue, each_related)
                     # END issue -> related files
                 # END issue -> file
 
@@ -124,36 +325,115 @@ class Collector(object):
             return e
         return None
 
+    def _commit_graph_files(self) -> typing.List[str]:
+        info_dir = os.path.join(self.config.repo_root, "objects", "info")
+        single = os.path.join(info_dir, "commit-graph")
+        if os.path.isfile(single):
+            return [single]
+
+        # split commit-graph
+        chain_dir = os.path.join(info_dir, "commit-graphs")
+        chain = os.path.join(chain_dir, "commit-graph-chain")
+        if not os.path.isfile(chain):
+            return []
+        with open(chain) as f:
+            return [os.path.join(chain_dir, f"graph-{each.strip()}.graph") for each in f if each.strip()]
+
+    @staticmethod
+    def _has_bloom_filters(graph_file: str) -> bool:
+        """ check the chunk table of a commit-graph file for BDAT chunk """
+        try:
+            with open(graph_file, "rb") as f:
+                header = f.read(8)
+                if len(header) != 8 or header[:4] != b"CGPH":
+                    return False
+                chunk_count = header[6]
+                # chunk table: (id: 4 bytes, offset: 8 bytes) * (count + 1)
+                table = f.read(12 * (chunk_count + 1))
+        except OSError:
+            return False
+
+        for i in range(chunk_count):
+            chunk_id, _ = struct.unpack(">4sQ", table[i * 12: (i + 1) * 12])
+            if chunk_id == b"BDAT":
+                return True
+        return False
+
+    def _prepare_commit_graph(self):
+        graph_files = self._commit_graph_files()
+        if graph_files and all(self._has_bloom_filters(each) for each in graph_files):
+            logger.info("commit-graph with changed-path bloom filters found")
+            return
+
+        logger.info("commit-graph with bloom filters not found, generating ...")
+        start = time.perf_counter()
+        subprocess.check_call(
+            ["git", "commit-graph", "write", "--reachable", "--changed-paths"],
+            cwd=self.config.repo_root,
+        )
+        logger.info(f"commit-graph generated in {time.perf_counter() - start:.3f}s")
+
+    def _create_path_filter(self) -> PathFilter:
+        include_patterns = list(self.config.include_patterns)
+        exclude_patterns = list(self.config.exclude_patterns)
+        if self.config.pattern_file:
+            file_include, file_exclude = PathFilter.load_pattern_file(self.config.pattern_file)
+            include_patterns += file_include
+            exclude_patterns += file_exclude
+        return PathFilter(include_patterns, exclude_patterns, self.config.include_regex)
+
+    def _iter_commits(self, repo: Repo, kwargs: typing.Dict[str, typing.Any]) -> typing.Iterator[Commit]:
+        """ commits filtered by commit_include_regex, max_depth_limit counted after filtering """
+        if not self.config.commit_include_regex:
+            kwargs["max_count"] = self.config.max_depth_limit
+            yield from repo.iter_commits(**kwargs)
+            return
+
+        # python re instead of `git log --grep`, whose regex dialects differ
+        regex = re.compile(self.config.commit_include_regex)
+        # limited after filtering, and DFS `no-walk` walks the history only with a max count
+        kwargs["max_count"] = -1
+        count = 0
+        for commit in repo.iter_commits(**kwargs):
+            if self.config.max_depth_limit != -1 and count >= self.config.max_depth_limit:
+                break
+            if not regex.match(self.git_reader.message(commit.hexsha)):
+                continue
+            count += 1
+            yield commit
+
+    def _create_file_ctx(self, ctx: RuntimeContext, name: str) -> FileContext:
+        if ctx.spill_store:
+            return SpilledFileContext(name, ctx.spill_store, message_getter=self.git_reader.message)
+        return FileContext(name)
+
     def _collect_files(self, ctx: RuntimeContext):
         """collect all files which tracked by git"""
         if self.config.include_file_list:
             logger.info("use specific file list")
             for each in self.config.include_file_list:
-                ctx.files[each] = FileContext(each)
+                ctx.files[each] = self._create_file_ctx(ctx, each)
             # END file list loop
             return
         # END check file list
 
-        logger.info("include file list is empty, use regex")
+        logger.info("include file list is empty, use path filter")
         git_repo = git.Repo(self.config.repo_root)
-        git_track_files = set([each[1].path for each in git_repo.index.iter_blobs()])
+        pathspecs = self.path_filter.to_pathspecs()
+        if pathspecs:
+            # push down to git
+            output = git_repo.git.ls_files("-z", "--", *pathspecs)
+            git_track_files = set(each for each in output.split("\0") if each)
+        else:
+            git_track_files = set([each[1].path for each in git_repo.index.iter_blobs()])
 
-        include_regex = None
-        if self.config.include_regex:
-            include_regex = re.compile(self.config.include_regex)
+        if self.config.file_level not in (FileLevelEnum.FILE, FileLevelEnum.DIR):
+            raise SrcTagException(f"invalid file level: {self.config.file_level}")
 
         for each in git_track_files:
-            if include_regex:
-                if not include_regex.match(each):
-                    continue
-
-            if self.config.file_level == FileLevelEnum.FILE:
-                ctx.files[each] = FileContext(each)
-            elif self.config.file_level == FileLevelEnum.DIR:
-                each_dir = os.path.dirname(each)
-                ctx.files[each_dir] = FileContext(each_dir)
-            else:
-                raise SrcTagException(f"invalid file level: {self.config.file_level}")
+            if not self.path_filter.match(each):
+                continue
+            ctx.files[each] = self._create_file_ctx(ctx, each)
 
         logger.info(f"file {len(ctx.files)} collected")
 
@@ -163,53 +443,58 @@ class Collector(object):
             "no-merges": True,
             "no-walk": True,
             "single-worktree": True,
-            "max-count": self.config.max_depth_limit,
         }
-        if self.config.commit_include_regex:
-            kwargs["grep"] = self.config.commit_include_regex
+        kwargs.update(self._time_window_kwargs())
+        return list(self._iter_commits(repo, kwargs))
 
-        result = []
-        for commit in repo.iter_commits(**kwargs):
-            result.append(commit)
-        return result
+    def _time_window_kwargs(self) -> typing.Dict[str, str]:
+        kwargs = dict()
+        if self.config.since:
+            kwargs["since"] = self.config.since
+        if self.config.until:
+            kwargs["until"] = self.config.until
+        return kwargs
 
     def _collect_histories(self, ctx: RuntimeContext):
         git_repo = git.Repo(self.config.repo_root)
+        if self.config.use_commit_graph:
+            git_repo.git.set_persistent_git_options(
+                c=["core.commitGraph=true", "commitGraph.readChangedPaths=true"]
+            )
 
+        start = time.perf_counter()
         for each_file, each_file_ctx in tqdm(ctx.files.items()):
             commits = self._collect_history(git_repo, each_file)
             each_file_ctx.commits = commits
 
+        cost = time.perf_counter() - start
+        if ctx.files:
+            logger.info(f"history of {len(ctx.files)} paths collected in {cost:.3f}s, "
+                        f"{cost / len(ctx.files) * 1000:.2f}ms per path")
+
     def _collect_histories_globally(self, ctx: RuntimeContext):
         git_repo = git.Repo(self.config.repo_root)
 
-        include_regex = None
-        if self.config.include_regex:
-            include_regex = re.compile(self.config.include_regex)
-
-        commit_include_regex = None
-        if self.config.commit_include_regex:
-            commit_include_regex = re.compile(self.config.commit_include_regex)
-
-        kwargs = dict()
-        if self.config.max_depth_limit != -1:
-            kwargs["max_count"] = self.config.max_depth_limit
-
-        for commit in tqdm(list(git_repo.iter_commits(**kwargs))):
-            if commit_include_regex:
-                if not commit_include_regex.match(commit.message):
-                    continue
-
-            for new_file in git_repo.git.show(commit.hexsha, name_only=True).split(
-                    os.linesep
-            ):
-                if include_regex:
-                    if not include_regex.match(new_file):
-                        continue
-
-                if self.config.file_level == FileLevelEnum.DIR:
-                    new_file = os.path.dirname(new_file)
-
+        kwargs = self._time_window_kwargs()
+        pathspecs = self.path_filter.to_pathspecs()
+        if pathspecs:
+            # skip the commits which touch nothing we care
+            kwargs["paths"] = pathspecs
+
+        commits = self._iter_commits(git_repo, kwargs)
+        if not ctx.spill_store:
+            # for progress bar
+            commits = list(commits)
+
+        # include_file_list contains dirs in DIR level
+        match_dirs = self.config.file_level == FileLevelEnum.DIR and bool(self.config.include_file_list)
+        for commit in tqdm(commits):
+            for new_file in self.git_reader.changed_files(commit.hexsha):
+                if match_dirs:
+                    # closest listed dir containing it
+                    while new_file and new_file not in ctx.files:
+                        new_file = RuntimeContext.dir_of(new_file)
+                # files already filtered when listing
                 each_file_ctx = ctx.files.get(new_file, None)
                 if each_file_ctx:
                     each_file_ctx.commits.append(commit)
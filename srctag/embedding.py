@@ -0,0 +1,34 @@
+import typing
+
+Documents = typing.List[str]
+Embeddings = typing.List[typing.List[float]]
+
+
+class EmbeddingFunction(typing.Protocol):
+    """ same as chroma's embedding function, without importing chromadb """
+
+    def __call__(self, input: Documents) -> Embeddings:
+        ...
+
+
+class SentenceTransformerEmbeddingFunction(EmbeddingFunction):
+    """ sentence-transformers model, loaded once per model name in a process """
+
+    models: typing.Dict[str, typing.Any] = dict()
+
+    def __init__(self, model_name: str, device: str = "cpu", normalize_embeddings: bool = False):
+        if model_name not in self.models:
+            # optional dep
+            from sentence_transformers import SentenceTransformer
+
+            self.models[model_name] = SentenceTransformer(model_name, device=device)
+        self.model_name = model_name
+        self._model = self.models[model_name]
+        self._normalize_embeddings = normalize_embeddings
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return self._model.encode(
+            list(input),
+            convert_to_numpy=True,
+            normalize_embeddings=self._normalize_embeddings,
+        ).tolist()
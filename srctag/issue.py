@@ -0,0 +1,109 @@
+import json
+import os
+import sqlite3
+import typing
+
+from loguru import logger
+
+from srctag.model import SrcTagException
+
+
+def iter_gh_issues(dump_file: str, chunk_size: int = 1024 * 1024) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+    """
+    stream issues from a GitHub issue dump with bounded memory
+
+    - JSON array: `gh issue list --json number,title,body > issues.json`
+    - JSONL: one issue object per line
+    """
+    decoder = json.JSONDecoder()
+    with open(dump_file, encoding="utf-8") as f:
+        buf = f.read(chunk_size)
+        stripped = buf.lstrip()
+        if not stripped:
+            return
+
+        if not stripped.startswith("["):
+            # jsonl
+            f.seek(0)
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+            return
+
+        pos = buf.index("[") + 1
+        eof = False
+        while True:
+            # skip separators
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+
+            try:
+                if pos >= len(buf):
+                    raise ValueError("need more data")
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise SrcTagException(f"not a valid issue dump: {dump_file}")
+                more = f.read(chunk_size)
+                eof = not more
+                # drop consumed content
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+
+            yield item
+            pos = end
+
+
+class IssueIndex(object):
+    """ issue id ("#11") -> title and body, in a sqlite file """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS issues (issue_id TEXT PRIMARY KEY, title TEXT, body TEXT)"
+        )
+
+    def put_many(self, rows: typing.Iterable[typing.Tuple[str, str, str]]):
+        self.conn.executemany("INSERT OR REPLACE INTO issues VALUES (?, ?, ?)", rows)
+        self.conn.commit()
+
+    def get(self, issue_id: str) -> typing.Optional[typing.Tuple[str, str]]:
+        return self.conn.execute("SELECT title, body FROM issues WHERE issue_id = ?", (issue_id,)).fetchone()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM issues").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    @classmethod
+    def build_from_gh_dump(cls, dump_file: str, index_path: str, batch_size: int = 1000) -> "IssueIndex":
+        """ build the index from a dump, skipped if the index is newer than dump """
+        if os.path.isfile(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(dump_file):
+            logger.info(f"issue index is up to date: {index_path}")
+            return cls(index_path)
+
+        # built aside and replaced on success, an interrupted build never looks up to date
+        tmp_path = f"{index_path}.tmp"
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        index = cls(tmp_path)
+
+        batch = []
+        for each in iter_gh_issues(dump_file):
+            batch.append((f'#{each["number"]}', each.get("title") or "", each.get("body") or ""))
+            if len(batch) >= batch_size:
+                index.put_many(batch)
+                batch = []
+        index.put_many(batch)
+        count = len(index)
+        index.close()
+
+        os.replace(tmp_path, index_path)
+        logger.info(f"load {count} issues from {dump_file} to {index_path}")
+        return cls(index_path)
@@ -3,6 +3,16 @@ import typing
 import networkx
 from git import Commit
 
+from srctag.profile import Profile
+
+
+class CommitRecord(object):
+    """ lightweight commit, with the same attributes as git.Commit used by srctag """
+
+    def __init__(self, hexsha: str, message: str):
+        self.hexsha = hexsha
+        self.message = message
+
 
 class FileContext(object):
     def __init__(self, name: str):
@@ -15,6 +25,91 @@ class RuntimeContext(object):
     def __init__(self):
         self.files: typing.Dict[str, FileContext] = dict()
         self.relations = networkx.Graph()
+        # collector.GitBatchReader, for reading commit objects by sha
+        self.git_reader = None
+        self.profile = Profile()
+        # spill.SpillStore, if commits are spilled to disk
+        self.spill_store = None
+        # spill.SpilledRelations, commit and issue relations spilled to disk, relations keeps the files only
+        self.spilled_relations = None
+
+    def commit_message(self, commit: typing.Union[Commit, CommitRecord]) -> str:
+        if isinstance(commit, CommitRecord):
+            return commit.message
+        if self.git_reader:
+            return self.git_reader.message(commit.hexsha)
+        return commit.message
+
+    def commit_time(self, commit: typing.Union[Commit, CommitRecord]) -> int:
+        if self.git_reader:
+            return self.git_reader.commit_time(commit.hexsha)
+        return commit.committed_date
+
+    def close(self):
+        """ stop git processes and close the spill store, in-memory files and relations are still usable """
+        if self.git_reader:
+            self.git_reader.close()
+        if self.spill_store:
+            self.spill_store.close()
+
+    @staticmethod
+    def dir_of(file_name: str, depth: int = -1) -> str:
+        """
+        dir node of a file
+
+        depth -1: its parent dir
+        depth  N: its first N path components at most
+        """
+        parts = file_name.split("/")[:-1]
+        if depth >= 0:
+            parts = parts[:depth]
+        return "/".join(parts)
+
+    def roll_up(self, depth: int = -1) -> "RuntimeContext":
+        """
+        aggregate a file level context into dir nodes, without running git again.
+        the original context is untouched, so both levels can be used after one collection.
+        """
+        # avoid circular import
+        from srctag.storage import MetadataConstant
+
+        ret = RuntimeContext()
+        ret.git_reader = self.git_reader
+        ret.profile = self.profile
+        ret.spill_store = self.spill_store
+
+        if self.spill_store:
+            from srctag.spill import SpilledFileContext, SpilledRelations
+
+            if self.spilled_relations:
+                ret.spilled_relations = SpilledRelations(self.spill_store, depth=depth)
+            for each_dir in self.spill_store.roll_up(self.files.keys(), depth):
+                ret.files[each_dir] = SpilledFileContext(each_dir, self.spill_store, depth=depth)
+        else:
+            seen: typing.Dict[str, typing.Set[str]] = dict()
+            for each_file in self.files.values():
+                each_dir = self.dir_of(each_file.name, depth)
+                if each_dir not in ret.files:
+                    ret.files[each_dir] = FileContext(each_dir)
+                    seen[each_dir] = set()
+
+                dir_ctx = ret.files[each_dir]
+                for each_commit in each_file.commits:
+                    if each_commit.hexsha in seen[each_dir]:
+                        continue
+                    seen[each_dir].add(each_commit.hexsha)
+                    dir_ctx.commits.append(each_commit)
+
+        def _map_node(node: str) -> str:
+            if self.relations.nodes[node].get("node_type") == MetadataConstant.KEY_SOURCE:
+                return self.dir_of(node, depth)
+            return node
+
+        for node, data in self.relations.nodes(data=True):
+            ret.relations.add_node(_map_node(node), **data)
+        for u, v in self.relations.edges():
+            ret.relations.add_edge(_map_node(u), _map_node(v))
+        return ret
 
 
 class SrcTagException(BaseException):
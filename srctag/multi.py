@@ -0,0 +1,92 @@
+import os
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from loguru import logger
+
+from srctag.collector import Collector, CollectorConfig
+from srctag.embedding import EmbeddingFunction
+from srctag.model import RuntimeContext
+from srctag.storage import Storage, StorageConfig
+from srctag.tagger import Tagger, TaggerConfig, TagResult
+
+
+class MultiRepoTagger(object):
+    """
+    tag multiple repos in one run
+
+    - one embedding backend (model) and one collection, docs are scoped by repo name
+    - tags are embedded only once
+    - collection (git heavy) runs in a worker pool
+    """
+
+    def __init__(self,
+                 collector_config: CollectorConfig = None,
+                 storage_config: StorageConfig = None,
+                 tagger_config: TaggerConfig = None,
+                 workers: int = 4,
+                 embedding_function: EmbeddingFunction = None):
+        self.collector_config = collector_config or CollectorConfig()
+        self.storage = Storage(storage_config, embedding_function=embedding_function)
+        self.tagger = Tagger(tagger_config)
+        self.workers = workers
+
+    @staticmethod
+    def repo_names(repo_roots: typing.List[str]) -> typing.Dict[str, str]:
+        """ repo root -> unique repo name """
+        ret = dict()
+        used = set()
+        for each in repo_roots:
+            name = os.path.basename(os.path.abspath(each))
+            candidate = name
+            index = 1
+            while candidate in used:
+                candidate = f"{name}_{index}"
+                index += 1
+            used.add(candidate)
+            ret[each] = candidate
+        return ret
+
+    def _collect(self, repo_root: str) -> RuntimeContext:
+        config = self.collector_config.model_copy()
+        config.repo_root = repo_root
+        ctx = Collector(config).collect_metadata()
+        # git processes restart on demand, instead of living for all the repos until their turn
+        ctx.git_reader.close()
+        return ctx
+
+    def repo_storage(self, repo_name: str) -> Storage:
+        config = self.storage.config.model_copy()
+        config.repo_name = repo_name
+        storage = Storage(config)
+        storage.share_backend(self.storage)
+        return storage
+
+    def tag(self, repo_roots: typing.List[str]) -> typing.Dict[str, TagResult]:
+        names = self.repo_names(repo_roots)
+        logger.info(f"collecting {len(repo_roots)} repos with {self.workers} workers ...")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            ctx_list = list(executor.map(self._collect, repo_roots))
+
+        # embedding model is already multi threaded inside,
+        # keep embedding and tagging in order
+        ret = dict()
+        for each_root, each_ctx in zip(repo_roots, ctx_list):
+            each_name = names[each_root]
+            logger.info(f"tagging repo: {each_name}")
+            storage = self.repo_storage(each_name)
+            storage.embed_ctx(each_ctx)
+            ret[each_name] = self.tagger.tag(storage)
+            each_ctx.close()
+        return ret
+
+    @staticmethod
+    def combine(results: typing.Dict[str, TagResult]) -> TagResult:
+        """ merge results into one, files are prefixed with repo name: `repo/path/to/file` """
+        dfs = []
+        for each_name, each_result in results.items():
+            df = each_result.scores_df.copy()
+            df.index = [f"{each_name}/{each}" for each in df.index]
+            dfs.append(df)
+        return TagResult(scores_df=pd.concat(dfs) if dfs else pd.DataFrame())
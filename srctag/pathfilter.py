@@ -0,0 +1,168 @@
+import re
+import typing
+
+GLOB_CHARS = set("*?[")
+
+
+class PathPattern(object):
+    """
+    gitignore / CODEOWNERS style pattern
+
+    - `*` matches anything except `/`, `**` matches any depth, `?` and `[...]` as usual
+    - a pattern with a `/` (except the trailing one) is anchored to repo root, otherwise matches at any depth
+    - a trailing `/` matches dirs only
+    - a pattern matching a dir matches everything under it
+    """
+
+    def __init__(self, pattern: str):
+        self.origin = pattern
+        self.dir_only = pattern.endswith("/")
+        body = pattern.rstrip("/")
+        self.anchored = "/" in body
+        self.body = body.lstrip("/")
+        self.is_literal = not (GLOB_CHARS & set(self.body))
+
+    def to_regex(self) -> str:
+        p = self.body
+        out = []
+        i = 0
+        while i < len(p):
+            if p.startswith("**/", i):
+                out.append("(?:.*/)?")
+                i += 3
+            elif p.startswith("**", i):
+                out.append(".*")
+                i += 2
+            elif p[i] == "*":
+                out.append("[^/]*")
+                i += 1
+            elif p[i] == "?":
+                out.append("[^/]")
+                i += 1
+            elif p[i] == "[" and p.find("]", i + 1) != -1:
+                end = p.find("]", i + 1)
+                chars = p[i + 1: end].replace("\\", "\\\\")
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                out.append(f"[{chars}]")
+                i = end + 1
+            else:
+                out.append(re.escape(p[i]))
+                i += 1
+
+        prefix = "" if self.anchored else "(?:.*/)?"
+        suffix = "/.*" if self.dir_only else "(?:/.*)?"
+        return prefix + "".join(out) + suffix
+
+    def to_pathspecs(self, exclude: bool = False) -> typing.List[str]:
+        magic = ":(exclude,glob)" if exclude else ":(glob)"
+        body = self.body if self.anchored else f"**/{self.body}"
+        if self.dir_only:
+            return [f"{magic}{body}/**"]
+        return [f"{magic}{body}", f"{magic}{body}/**"]
+
+
+class PatternSet(object):
+    """
+    many patterns matched together
+
+    literal patterns are looked up by path prefixes and path components (like a trie walk),
+    others are compiled into one combined regex.
+    """
+
+    def __init__(self, patterns: typing.Iterable[str]):
+        self.patterns = [PathPattern(each) for each in patterns if each]
+
+        # "a/b" -> matches "a/b" and "a/b/..."
+        self.anchored: typing.Set[str] = set()
+        # "a/b/" -> matches "a/b/..."
+        self.anchored_dirs: typing.Set[str] = set()
+        # "b" -> matches any component
+        self.names: typing.Set[str] = set()
+        # "b/" -> matches any dir component
+        self.dir_names: typing.Set[str] = set()
+
+        regex_list = []
+        for each in self.patterns:
+            if not each.is_literal:
+                regex_list.append(each.to_regex())
+            elif each.anchored:
+                (self.anchored_dirs if each.dir_only else self.anchored).add(each.body)
+            else:
+                (self.dir_names if each.dir_only else self.names).add(each.body)
+
+        self.regex: typing.Optional[typing.Pattern] = None
+        if regex_list:
+            self.regex = re.compile("|".join(f"(?:{each})" for each in regex_list))
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def match(self, path: str) -> bool:
+        parts = path.split("/")
+        if self.names or self.dir_names:
+            if self.names.intersection(parts) or self.dir_names.intersection(parts[:-1]):
+                return True
+
+        if self.anchored or self.anchored_dirs:
+            prefix = ""
+            for index, each in enumerate(parts):
+                prefix = f"{prefix}/{each}" if prefix else each
+                if prefix in self.anchored:
+                    return True
+                if index < len(parts) - 1 and prefix in self.anchored_dirs:
+                    return True
+
+        if self.regex and self.regex.fullmatch(path):
+            return True
+        return False
+
+    def to_pathspecs(self, exclude: bool = False) -> typing.List[str]:
+        ret = []
+        for each in self.patterns:
+            ret.extend(each.to_pathspecs(exclude))
+        return ret
+
+
+class PathFilter(object):
+    """ include_regex, include patterns and exclude patterns, applied together """
+
+    def __init__(self,
+                 include_patterns: typing.Iterable[str] = (),
+                 exclude_patterns: typing.Iterable[str] = (),
+                 include_regex: str = ""):
+        self.include = PatternSet(include_patterns)
+        self.exclude = PatternSet(exclude_patterns)
+        self.include_regex = re.compile(include_regex) if include_regex else None
+
+    @staticmethod
+    def load_pattern_file(path: str) -> typing.Tuple[typing.List[str], typing.List[str]]:
+        """
+        CODEOWNERS-like file: the first column of each line is a pattern, `!` prefix for excluding.
+        returns (include patterns, exclude patterns)
+        """
+        include, exclude = [], []
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                pattern = line.split()[0]
+                if pattern.startswith("!"):
+                    exclude.append(pattern[1:])
+                else:
+                    include.append(pattern)
+        return include, exclude
+
+    def match(self, path: str) -> bool:
+        if self.include_regex and not self.include_regex.match(path):
+            return False
+        if self.include and not self.include.match(path):
+            return False
+        if self.exclude and self.exclude.match(path):
+            return False
+        return True
+
+    def to_pathspecs(self) -> typing.List[str]:
+        """ git pathspecs for pushing down, include_regex can not be converted and will be ignored """
+        return self.include.to_pathspecs() + self.exclude.to_pathspecs(exclude=True)
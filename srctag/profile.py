@@ -0,0 +1,95 @@
+import contextlib
+import json
+import sys
+import time
+import typing
+from collections import OrderedDict
+
+from loguru import logger
+from pydantic import BaseModel
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+
+class ProfileStage(object):
+    # collector
+    FILE_LISTING = "file_listing"
+    HISTORY_WALK = "history_walk"
+    DIFF_STATS = "diff_stats"
+    RELATION_BUILDING = "relation_building"
+
+    # storage
+    MODEL_LOADING = "model_loading"
+    EMBEDDING = "embedding"
+    CHROMA_INSERT = "chroma_insert"
+
+    # tagger
+    QUERY = "query"
+    AGGREGATION = "aggregation"
+    EXPORT = "export"
+
+
+class StageRecord(BaseModel):
+    name: str
+    # total wall time in seconds
+    wall_time: float = 0.0
+    # how many times this stage entered
+    calls: int = 0
+    # items processed, meaning depends on stage (files, commits, docs ...)
+    count: int = 0
+    # how much the process peak RSS (bytes) rose while in this stage, summed over calls.
+    # the peak is process-wide, so it stays 0 for a stage running below an earlier peak.
+    peak_rss_growth: int = 0
+
+
+def get_peak_rss() -> int:
+    if not resource:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macos, kilobytes on linux
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+
+class Profile(object):
+    """
+    records wall time, counts and peak memory growth for each stage of a run.
+    stages can be nested (eg: diff_stats happens inside history_walk with BFS).
+    """
+
+    def __init__(self):
+        self.stages: typing.Dict[str, StageRecord] = OrderedDict()
+
+    def get_stage(self, name: str) -> StageRecord:
+        if name not in self.stages:
+            self.stages[name] = StageRecord(name=name)
+        return self.stages[name]
+
+    @contextlib.contextmanager
+    def stage(self, name: str, count: int = 0):
+        record = self.get_stage(name)
+        start_peak_rss = get_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.wall_time += time.perf_counter() - start
+            record.calls += 1
+            record.count += count
+            record.peak_rss_growth += get_peak_rss() - start_peak_rss
+
+    def add_count(self, name: str, count: int):
+        self.get_stage(name).count += count
+
+    def to_dict(self) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        return {k: v.model_dump() for k, v in self.stages.items()}
+
+    def export_json(self, path: str):
+        logger.info(f"dump profile to json: {path}")
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
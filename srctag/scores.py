@@ -0,0 +1,128 @@
+import typing
+
+import numpy as np
+import pandas as pd
+
+
+class SparseScores(object):
+    """
+    file x tag score matrix in COO form (rows, cols, values), missing cells are NaN.
+    memory is proportional to the scored cells, instead of files x tags.
+
+    all the operations give the same values as the dense DataFrame ones:
+    - optimize: `Tagger.optimize`
+    - rank: `df.rank(axis=0, method="min")`
+    - normalize: `(df - df.min()) / (df.max() - df.min())`
+    """
+
+    def __init__(self, files: typing.List[str], tags: typing.List[str],
+                 rows: np.ndarray, cols: np.ndarray, values: np.ndarray):
+        self.files = files
+        self.tags = tags
+        self.rows = rows
+        self.cols = cols
+        self.values = values
+
+    @classmethod
+    def from_nested_dict(cls, data: typing.Dict[str, typing.Dict[str, float]]) -> "SparseScores":
+        """ file -> tag -> score, same order as `pd.DataFrame.from_dict(data, orient="index")` """
+        files = list(data.keys())
+        tag_index: typing.Dict[str, int] = dict()
+        rows, cols, values = [], [], []
+        for row, each_tags in enumerate(data.values()):
+            for each_tag, each_score in each_tags.items():
+                col = tag_index.setdefault(each_tag, len(tag_index))
+                rows.append(row)
+                cols.append(col)
+                values.append(each_score)
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+
+        # pandas builds it column by column, files are ordered by their first appearance in columns
+        by_col = rows[np.argsort(cols, kind="stable")]
+        _, first = np.unique(by_col, return_index=True)
+        row_order = by_col[np.sort(first)]
+        new_rows = np.empty(len(files), dtype=np.int64)
+        new_rows[row_order] = np.arange(len(row_order))
+
+        return cls(
+            [files[i] for i in row_order],
+            list(tag_index.keys()),
+            new_rows[rows],
+            cols,
+            np.asarray(values, dtype=np.float64),
+        )
+
+    def _drop_nan(self):
+        keep = ~np.isnan(self.values)
+        if not keep.all():
+            self.rows, self.cols, self.values = self.rows[keep], self.cols[keep], self.values[keep]
+
+    def optimize(self, scale_factor: float = 2.0) -> "SparseScores":
+        # sum in column order, same rows always get the same weights
+        order = np.lexsort((self.cols, self.rows))
+        self.rows, self.cols = self.rows[order], self.cols[order]
+        values = np.exp(self.values[order] * scale_factor)
+
+        # row variances (ddof=1) over the scored cells, two passes like pandas
+        counts = np.bincount(self.rows, minlength=len(self.files))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.bincount(self.rows, values, minlength=len(self.files)) / counts
+            squares = np.bincount(self.rows, (values - means[self.rows]) ** 2, minlength=len(self.files))
+            row_variances = np.where(counts > 1, squares / (counts - 1), np.nan)
+
+            max_variance = np.nanmax(row_variances) if (~np.isnan(row_variances)).any() else np.nan
+            weights = 1.0 - row_variances / max_variance
+            self.values = values * weights[self.rows]
+        # rows without a variance are NaN
+        self._drop_nan()
+        return self
+
+    def rank(self) -> "SparseScores":
+        """ column-wise rank, ties get the min rank """
+        order = np.lexsort((self.values, self.cols))
+        cols = self.cols[order]
+        values = self.values[order]
+        positions = np.arange(len(order))
+
+        new_col = np.ones(len(order), dtype=bool)
+        new_col[1:] = cols[1:] != cols[:-1]
+        new_run = new_col.copy()
+        new_run[1:] |= values[1:] != values[:-1]
+
+        col_starts = np.maximum.accumulate(np.where(new_col, positions, 0))
+        run_starts = np.maximum.accumulate(np.where(new_run, positions, 0))
+
+        ranks = np.empty(len(order), dtype=np.float64)
+        ranks[order] = run_starts - col_starts + 1
+        self.values = ranks
+        return self
+
+    def normalize(self) -> "SparseScores":
+        """ column-wise min-max """
+        col_min = np.full(len(self.tags), np.inf)
+        col_max = np.full(len(self.tags), -np.inf)
+        np.minimum.at(col_min, self.cols, self.values)
+        np.maximum.at(col_max, self.cols, self.values)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.values = (self.values - col_min[self.cols]) / (col_max[self.cols] - col_min[self.cols])
+        self._drop_nan()
+        return self
+
+    def to_dataframe(self, sparse: bool = False) -> pd.DataFrame:
+        """ dense DataFrame, or columns of `SparseDtype(float, nan)` """
+        if not sparse:
+            dense = np.full((len(self.files), len(self.tags)), np.nan)
+            dense[self.rows, self.cols] = self.values
+            return pd.DataFrame(dense, index=self.files, columns=self.tags)
+
+        columns = dict()
+        order = np.argsort(self.cols, kind="stable")
+        bounds = np.searchsorted(self.cols[order], np.arange(len(self.tags) + 1))
+        for col, each_tag in enumerate(self.tags):
+            picked = order[bounds[col]: bounds[col + 1]]
+            # one column at a time
+            dense = np.full(len(self.files), np.nan)
+            dense[self.rows[picked]] = self.values[picked]
+            columns[each_tag] = pd.arrays.SparseArray(dense, fill_value=np.nan)
+        return pd.DataFrame(columns, index=self.files)
@@ -0,0 +1,37 @@
+import json
+import os
+
+from loguru import logger
+
+SNAPSHOT_META_FILE = "srctag-snapshot.json"
+
+
+def default_cache_dir() -> str:
+    return os.path.join(os.path.expanduser("~"), ".cache", "srctag", "models")
+
+
+def snapshot_path(model_name: str, cache_dir: str = "") -> str:
+    return os.path.join(cache_dir or default_cache_dir(), model_name.replace("/", "__"))
+
+
+def has_snapshot(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, SNAPSHOT_META_FILE))
+
+
+def save_snapshot(model_name: str, path: str) -> str:
+    """
+    save a sentence-transformers model as a local snapshot, for fast loading:
+
+    - weights in safetensors, memory mapped on loading instead of unpickling
+    - fast tokenizer (tokenizer.json) saved alongside
+    - loaded from a local dir, no hub lookups
+    """
+    # optional dep
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    model.save(path, safe_serialization=True)
+    with open(os.path.join(path, SNAPSHOT_META_FILE), "w") as f:
+        json.dump({"model_name": model_name}, f)
+    logger.info(f"model snapshot saved: {model_name} -> {path}")
+    return path
@@ -0,0 +1,261 @@
+import sqlite3
+import typing
+
+from srctag.model import CommitRecord, FileContext, RuntimeContext, SrcTagException
+
+
+class SpillStore(object):
+    """
+    commit records, file -> commit postings and commit / issue relations in a sqlite file,
+    keeps memory roughly constant regardless of history size.
+    """
+
+    def __init__(self, path: str, flush_size: int = 10000):
+        self.path = path
+        self.flush_size = flush_size
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS commits (sha TEXT PRIMARY KEY, message TEXT);
+            CREATE TABLE IF NOT EXISTS postings (file TEXT, sha TEXT, UNIQUE(file, sha));
+            CREATE INDEX IF NOT EXISTS postings_file ON postings (file);
+            -- rolled up postings, keyed by dir depth
+            CREATE TABLE IF NOT EXISTS dir_postings (depth INTEGER, dir TEXT, sha TEXT, UNIQUE(depth, dir, sha));
+            -- commit and issue nodes of the relation graph, and their edges to files
+            CREATE TABLE IF NOT EXISTS events (node TEXT PRIMARY KEY, node_type TEXT, timestamp INTEGER);
+            CREATE TABLE IF NOT EXISTS event_files (node TEXT, file TEXT, UNIQUE(node, file));
+        """)
+        self.conn.create_function("dir_of", 2, RuntimeContext.dir_of, deterministic=True)
+        self._pending_commits: typing.List[typing.Tuple[str, str]] = []
+        self._pending_shas: typing.Set[str] = set()
+        self._pending_postings: typing.List[typing.Tuple[str, str]] = []
+        self._pending_events: typing.List[typing.Tuple[str, str, int]] = []
+        self._pending_event_files: typing.List[typing.Tuple[str, str]] = []
+        self.closed = False
+
+    def clear(self):
+        """ drop everything from earlier runs """
+        self._pending_commits = []
+        self._pending_shas = set()
+        self._pending_postings = []
+        self._pending_events = []
+        self._pending_event_files = []
+        self.conn.executescript("""
+            DELETE FROM commits;
+            DELETE FROM postings;
+            DELETE FROM dir_postings;
+            DELETE FROM events;
+            DELETE FROM event_files;
+        """)
+        self.conn.commit()
+
+    def has_commit(self, sha: str) -> bool:
+        if sha in self._pending_shas:
+            return True
+        return self.conn.execute("SELECT 1 FROM commits WHERE sha = ?", (sha,)).fetchone() is not None
+
+    def add_commit(self, sha: str, message: str):
+        self._pending_commits.append((sha, message))
+        self._pending_shas.add(sha)
+        self._maybe_flush()
+
+    def add_posting(self, file_name: str, sha: str):
+        self._pending_postings.append((file_name, sha))
+        self._maybe_flush()
+
+    def add_event(self, node: str, node_type: str, timestamp: int = 0):
+        self._pending_events.append((node, node_type, timestamp))
+        self._maybe_flush()
+
+    def add_event_file(self, node: str, file_name: str):
+        self._pending_event_files.append((node, file_name))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        pending = (len(self._pending_commits) + len(self._pending_postings)
+                   + len(self._pending_events) + len(self._pending_event_files))
+        if pending >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if self._pending_commits:
+            self.conn.executemany("INSERT OR IGNORE INTO commits VALUES (?, ?)", self._pending_commits)
+            self._pending_commits = []
+            self._pending_shas = set()
+        if self._pending_postings:
+            self.conn.executemany("INSERT OR IGNORE INTO postings VALUES (?, ?)", self._pending_postings)
+            self._pending_postings = []
+        if self._pending_events:
+            self.conn.executemany("INSERT OR IGNORE INTO events VALUES (?, ?, ?)", self._pending_events)
+            self._pending_events = []
+        if self._pending_event_files:
+            self.conn.executemany("INSERT OR IGNORE INTO event_files VALUES (?, ?)", self._pending_event_files)
+            self._pending_event_files = []
+        self.conn.commit()
+
+    def iter_commits(self, file_name: str, depth: typing.Optional[int] = None) -> typing.Iterator[CommitRecord]:
+        """ commits of a file, or of a rolled up dir if depth set """
+        self.flush()
+        if depth is None:
+            cursor = self.conn.execute(
+                "SELECT c.sha, c.message FROM postings p JOIN commits c ON p.sha = c.sha "
+                "WHERE p.file = ? ORDER BY p.rowid",
+                (file_name,),
+            )
+        else:
+            cursor = self.conn.execute(
+                "SELECT c.sha, c.message FROM dir_postings p JOIN commits c ON p.sha = c.sha "
+                "WHERE p.depth = ? AND p.dir = ? ORDER BY p.rowid",
+                (depth, file_name),
+            )
+        for sha, message in cursor:
+            yield CommitRecord(sha, message)
+
+    def count(self, file_name: str, depth: typing.Optional[int] = None) -> int:
+        self.flush()
+        if depth is None:
+            return self.conn.execute("SELECT COUNT(*) FROM postings WHERE file = ?", (file_name,)).fetchone()[0]
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM dir_postings WHERE depth = ? AND dir = ?", (depth, file_name)
+        ).fetchone()[0]
+
+    def roll_up(self, file_names: typing.Iterable[str], depth: int) -> typing.List[str]:
+        """ write postings of dirs (kept apart from file postings), returns dir names """
+        self.flush()
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS roll_up_files (file TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM roll_up_files")
+        self.conn.executemany("INSERT OR IGNORE INTO roll_up_files VALUES (?)", ((each,) for each in file_names))
+        self.conn.execute(
+            "INSERT OR IGNORE INTO dir_postings (depth, dir, sha) "
+            "SELECT ?, dir_of(p.file, ?), p.sha FROM postings p JOIN roll_up_files f ON p.file = f.file "
+            "ORDER BY p.rowid",
+            (depth, depth),
+        )
+        self.conn.commit()
+        return [each for each, in self.conn.execute("SELECT DISTINCT dir_of(file, ?) FROM roll_up_files", (depth,))]
+
+    def iter_events(self, node_type: str) -> typing.Iterator[typing.Tuple[str, int]]:
+        """ (node, timestamp) of commits or issues """
+        self.flush()
+        yield from self.conn.execute("SELECT node, timestamp FROM events WHERE node_type = ?", (node_type,))
+
+    def iter_event_files(self, depth: typing.Optional[int] = None
+                         ) -> typing.Iterator[typing.Tuple[str, str, int, str]]:
+        """ (node, node_type, timestamp, file) ordered by node, files rolled up into dirs if depth set """
+        self.flush()
+        file_column = "f.file" if depth is None else "dir_of(f.file, :depth)"
+        yield from self.conn.execute(
+            f"SELECT DISTINCT f.node, e.node_type, e.timestamp, {file_column} "
+            f"FROM event_files f JOIN events e ON f.node = e.node ORDER BY f.node",
+            {"depth": depth},
+        )
+
+    def files_of_event(self, node: str, depth: typing.Optional[int] = None) -> typing.List[str]:
+        self.flush()
+        file_column = "file" if depth is None else "dir_of(file, :depth)"
+        return [each for each, in self.conn.execute(
+            f"SELECT DISTINCT {file_column} FROM event_files WHERE node = :node ORDER BY rowid",
+            {"node": node, "depth": depth},
+        )]
+
+    def count_event_files(self) -> int:
+        self.flush()
+        return self.conn.execute("SELECT COUNT(*) FROM event_files").fetchone()[0]
+
+    def close(self):
+        # shared by rolled up contexts
+        if self.closed:
+            return
+        self.flush()
+        self.conn.close()
+        self.closed = True
+
+
+class SpilledCommitList(object):
+    """ list-like view of commits of a file, backed by SpillStore """
+
+    def __init__(self, store: SpillStore, file_name: str, message_getter: typing.Callable[[str], str] = None,
+                 depth: typing.Optional[int] = None):
+        self.store = store
+        self.file_name = file_name
+        self.message_getter = message_getter
+        # rolled up dir at this depth, read only
+        self.depth = depth
+
+    def append(self, commit: typing.Any):
+        if self.depth is not None:
+            raise SrcTagException(f"rolled up dir is read only: {self.file_name}")
+        if not self.store.has_commit(commit.hexsha):
+            if self.message_getter:
+                message = self.message_getter(commit.hexsha)
+            else:
+                message = commit.message
+            self.store.add_commit(commit.hexsha, message)
+        self.store.add_posting(self.file_name, commit.hexsha)
+
+    def extend(self, commits: typing.Iterable[typing.Any]):
+        for each in commits:
+            self.append(each)
+
+    def __iter__(self) -> typing.Iterator[CommitRecord]:
+        return self.store.iter_commits(self.file_name, self.depth)
+
+    def __len__(self) -> int:
+        return self.store.count(self.file_name, self.depth)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+
+class SpilledFileContext(FileContext):
+    def __init__(self, name: str, store: SpillStore, message_getter: typing.Callable[[str], str] = None,
+                 depth: typing.Optional[int] = None):
+        super().__init__(name)
+        self._commits = SpilledCommitList(store, name, message_getter, depth)
+
+    @property
+    def commits(self) -> SpilledCommitList:
+        return self._commits
+
+    @commits.setter
+    def commits(self, value: typing.Iterable[typing.Any]):
+        # postings are append only
+        # and FileContext.__init__ sets an empty list before the store ready
+        commits = getattr(self, "_commits", None)
+        if commits is None or value is commits:
+            return
+        commits.extend(value)
+
+
+class SpilledRelations(object):
+    """
+    commit and issue nodes of the relation graph with their edges to files, backed by SpillStore.
+    file nodes stay in RuntimeContext.relations, which is bounded by the file count.
+    """
+
+    def __init__(self, store: SpillStore, depth: typing.Optional[int] = None):
+        self.store = store
+        # rolled up dirs at this depth, read only
+        self.depth = depth
+
+    def add_node(self, node: str, node_type: str, timestamp: int = 0):
+        self.store.add_event(node, node_type, timestamp)
+
+    def add_edge(self, node: str, file_name: str):
+        if self.depth is not None:
+            raise SrcTagException("rolled up relations are read only")
+        self.store.add_event_file(node, file_name)
+
+    def nodes(self, node_type: str) -> typing.Iterator[typing.Tuple[str, int]]:
+        """ (node, timestamp) """
+        return self.store.iter_events(node_type)
+
+    def edges(self) -> typing.Iterator[typing.Tuple[str, str, int, str]]:
+        """ (node, node_type, timestamp, file), grouped by node """
+        return self.store.iter_event_files(self.depth)
+
+    def neighbors(self, node: str) -> typing.List[str]:
+        """ files (or dirs) of a commit or an issue """
+        return self.store.files_of_event(node, self.depth)
+
+    def number_of_edges(self) -> int:
+        return self.store.count_event_files()
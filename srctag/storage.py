@@ -1,18 +1,26 @@
 import json
 import typing
+from enum import Enum
 
-import chromadb
 import networkx as nx
-from chromadb import API
-from chromadb.api.models.Collection import Collection
-from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
 from loguru import logger
 from networkx import Graph
 from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 from tqdm import tqdm
 
+from srctag.checkpoint import CheckpointJournal
+from srctag.embedding import EmbeddingFunction, SentenceTransformerEmbeddingFunction
+from srctag.issue import IssueIndex
 from srctag.model import FileContext, RuntimeContext, SrcTagException
+from srctag.profile import Profile, ProfileStage
+from srctag.snapshot import snapshot_path, has_snapshot
+from srctag.vectorstore import NumpyCollection
+
+if typing.TYPE_CHECKING:
+    # imported only with CHROMA backend, it takes seconds
+    from chromadb import API
+    from chromadb.api.models.Collection import Collection
 
 
 class StorageDoc(BaseModel):
@@ -27,26 +35,56 @@ class MetadataConstant(object):
     KEY_DATA_TYPE = "data_type"
     KEY_ISSUE_ID = "issue_id"
     KEY_TAG = "tag"
+    KEY_REPO = "repo"
 
     # use in chroma
     DATA_TYPE_COMMIT_MSG = "commit_msg"
     DATA_TYPE_ISSUE = "issue"
 
 
+class StorageBackendEnum(str, Enum):
+    CHROMA: str = "CHROMA"
+    # numpy matrix, without database
+    NUMPY: str = "NUMPY"
+
+
 class StorageConfig(BaseSettings):
     db_path: str = ""
     collection_name: str = "default_collection"
 
+    backend: StorageBackendEnum = StorageBackendEnum.CHROMA
+    # only works with NUMPY backend
+    # IVF lists for approximate search, 0 for exact search
+    ivf_nlist: int = 0
+    ivf_nprobe: int = 8
+
     # English: paraphrase-MiniLM-L6-v2
     # Multi langs: paraphrase-multilingual-MiniLM-L12-v2
     st_model_name: str = "paraphrase-MiniLM-L6-v2"
+    # local model snapshots created by `srctag prepare`, default to ~/.cache/srctag/models
+    model_cache_dir: str = ""
 
     # content mapping for avoiding too much I/O
     # "#11" -> "content for #11"
     issue_mapping: typing.Dict[str, str] = dict()
 
+    # on-disk issue index (sqlite), for large dumps
+    # see `load_issue_index_from_gh_dump`
+    issue_index_path: str = ""
+    # use issue title and body as document, otherwise title only
+    issue_with_body: bool = False
+
     data_types: typing.Set[str] = {MetadataConstant.DATA_TYPE_COMMIT_MSG, MetadataConstant.DATA_TYPE_ISSUE}
 
+    # docs per upsert call
+    write_batch_size: int = 256
+    # record progress in a journal next to db_path, and resume from it after interrupted
+    checkpoint: bool = True
+
+    # docs will be scoped by this name if set
+    # for sharing one collection between different repos
+    repo_name: str = ""
+
     def load_issue_mapping_from_gh_json_file(self, gh_json_file: str):
         with open(gh_json_file) as f:
             content = json.load(f)
@@ -57,21 +95,73 @@ class StorageConfig(BaseSettings):
             self.issue_mapping[sharp_id] = each["title"]
         logger.info(f"load {len(content)} issues from {gh_json_file}")
 
+    def load_issue_index_from_gh_dump(self, gh_dump_file: str, index_path: str = ""):
+        """ streaming version of `load_issue_mapping_from_gh_json_file`, supports json and jsonl """
+        if not index_path:
+            index_path = f"{gh_dump_file}.srctag.db"
+        IssueIndex.build_from_gh_dump(gh_dump_file, index_path).close()
+        self.issue_index_path = index_path
+
+    def has_issues(self) -> bool:
+        return bool(self.issue_mapping or self.issue_index_path)
+
 
 class Storage(object):
-    def __init__(self, config: StorageConfig = None):
+    def __init__(self, config: StorageConfig = None, embedding_function: EmbeddingFunction = None):
         if not config:
             config = StorageConfig()
         self.config = config
 
-        self.chromadb: typing.Optional[API] = None
-        self.chromadb_collection: typing.Optional[Collection] = None
+        self.chromadb: typing.Optional["API"] = None
+        # chroma collection, or NumpyCollection with NUMPY backend
+        self.chromadb_collection: typing.Optional[typing.Union["Collection", NumpyCollection]] = None
+        # by default, SentenceTransformer with config.st_model_name
+        self.embedding_function: typing.Optional[EmbeddingFunction] = embedding_function
         self.relations: Graph = nx.Graph()
+        # spill.SpilledRelations of the embedded ctx, in spill mode
+        self.spilled_relations = None
+        self.profile: Profile = Profile()
+        self.issue_index: typing.Optional[IssueIndex] = None
+
+        # only used inside embed_ctx
+        self.checkpoint: typing.Optional[CheckpointJournal] = None
+        # doc id -> (document, metadata), None for writing directly
+        self._pending_docs: typing.Optional[typing.Dict[str, typing.Tuple[str, typing.Dict[str, str]]]] = None
+        self._pending_files: typing.List[str] = []
+        self._written_docs: typing.Set[str] = set()
+
+    def model_source(self) -> str:
+        """ local snapshot of st_model_name if prepared, otherwise the model name """
+        path = snapshot_path(self.config.st_model_name, self.config.model_cache_dir)
+        if has_snapshot(path):
+            return path
+        return self.config.st_model_name
+
+    def init_embedding_function(self):
+        if self.embedding_function:
+            return
+
+        source = self.model_source()
+        with self.profile.stage(ProfileStage.MODEL_LOADING):
+            self.embedding_function = SentenceTransformerEmbeddingFunction(model_name=source)
+        logger.info(f"model loaded from: {source}")
 
     def init_chroma(self):
-        if self.chromadb and self.chromadb_collection:
+        if self.chromadb_collection is not None:
             return
 
+        self.init_embedding_function()
+        if self.config.backend == StorageBackendEnum.NUMPY:
+            self.chromadb_collection = NumpyCollection(
+                self.config.collection_name,
+                path=self.config.db_path,
+                nlist=self.config.ivf_nlist,
+                nprobe=self.config.ivf_nprobe,
+            )
+            return
+
+        import chromadb
+
         if self.config.db_path:
             self.chromadb = chromadb.PersistentClient(path=self.config.db_path)
         else:
@@ -80,20 +170,18 @@ class Storage(object):
 
         self.chromadb_collection = self.chromadb.get_or_create_collection(
             self.config.collection_name,
-            embedding_function=SentenceTransformerEmbeddingFunction(
-                model_name=self.config.st_model_name
-            ),
+            embedding_function=self.embedding_function,
             # dis range: [0, 1]
             metadata={"hnsw:space": "l2"}
         )
 
-    def process_commit_msg(self, file: FileContext, collection: Collection, _: RuntimeContext):
+    def process_commit_msg(self, file: FileContext, collection: "Collection", ctx: RuntimeContext):
         """ can be overwritten for custom processing """
         targets = []
         for each in file.commits:
             # keep enough data in metadata for calc the final score
             item = StorageDoc(
-                document=each.message,
+                document=ctx.commit_message(each),
                 metadata={
                     MetadataConstant.KEY_SOURCE: file.name,
                     MetadataConstant.KEY_COMMIT_SHA: str(each.hexsha),
@@ -103,21 +191,32 @@ class Storage(object):
             )
             targets.append(item)
 
-        for each in targets:
-            collection.add(
-                documents=[each.document],
-                metadatas=[each.metadata],
-                ids=[each.id],
-            )
+        self.write_docs(targets, collection)
 
     def process_issue_id_to_title(self, issue_id: str) -> str:
         # easily reach the API limit if using server API here,
         # so we use issue_mapping, keep it simple
-        return self.config.issue_mapping.get(issue_id, "")
-
-    def process_issue(self, _: FileContext, collection: Collection, ctx: RuntimeContext):
-        issue_id_list = [x for x, y in ctx.relations.nodes(data=True) if
-                         y["node_type"] == MetadataConstant.KEY_ISSUE_ID]
+        if issue_id in self.config.issue_mapping:
+            return self.config.issue_mapping[issue_id]
+
+        if not self.config.issue_index_path:
+            return ""
+        if not self.issue_index:
+            self.issue_index = IssueIndex(self.config.issue_index_path)
+        row = self.issue_index.get(issue_id)
+        if not row:
+            return ""
+        title, body = row
+        if self.config.issue_with_body and body:
+            return f"{title}\n{body}"
+        return title
+
+    def process_issue(self, _: FileContext, collection: "Collection", ctx: RuntimeContext):
+        if ctx.spilled_relations:
+            issue_id_list = (x for x, _ in ctx.spilled_relations.nodes(MetadataConstant.KEY_ISSUE_ID))
+        else:
+            issue_id_list = [x for x, y in ctx.relations.nodes(data=True) if
+                             y["node_type"] == MetadataConstant.KEY_ISSUE_ID]
 
         targets = []
         for each_issue_id in issue_id_list:
@@ -138,14 +237,100 @@ class Storage(object):
             # END issue loop
         # END commit loop
 
-        for each in targets:
+        self.write_docs(targets, collection)
+
+    def write_docs(self, targets: typing.List[StorageDoc], collection: "Collection"):
+        """ embed docs and upsert them to collection. inside embed_ctx, docs are buffered and written in batches """
+        if not targets:
+            return
+
+        metadatas = [each.metadata for each in targets]
+        ids = [each.id for each in targets]
+        if self.config.repo_name:
+            for each in metadatas:
+                each[MetadataConstant.KEY_REPO] = self.config.repo_name
+            ids = [f"{self.config.repo_name}|{each}" for each in ids]
+        documents = [each.document for each in targets]
+
+        if self._pending_docs is None:
+            self._upsert(collection, ids, documents, metadatas)
+            return
+
+        for each_id, each_document, each_metadata in zip(ids, documents, metadatas):
+            if each_id in self._pending_docs or each_id in self._written_docs:
+                continue
+            if self.checkpoint and self.checkpoint.has_doc(each_id):
+                continue
+            self._pending_docs[each_id] = (each_document, each_metadata)
+
+    def _upsert(self, collection: "Collection", ids: typing.List[str], documents: typing.List[str],
+                metadatas: typing.List[typing.Dict[str, str]]):
+        with self.profile.stage(ProfileStage.EMBEDDING, count=len(ids)):
+            embeddings = self.embedding_function(documents)
+
+        with self.profile.stage(ProfileStage.CHROMA_INSERT, count=len(ids)):
+            # idempotent, safe for resuming
             collection.upsert(
-                documents=[each.document],
-                metadatas=[each.metadata],
-                ids=[each.id],
+                documents=documents,
+                metadatas=metadatas,
+                ids=ids,
+                embeddings=embeddings,
+            )
+
+    def flush_docs(self):
+        """ write buffered docs in batches, then record them and the finished files in checkpoint """
+        ids = list(self._pending_docs.keys())
+        batch_size = self.config.write_batch_size
+        for i in range(0, len(ids), batch_size):
+            batch_ids = ids[i: i + batch_size]
+            self._upsert(
+                self.chromadb_collection,
+                batch_ids,
+                [self._pending_docs[each][0] for each in batch_ids],
+                [self._pending_docs[each][1] for each in batch_ids],
             )
+        if ids:
+            self.persist()
+
+        if self.checkpoint:
+            self.checkpoint.commit(self._pending_files, ids)
+        else:
+            # the journal already remembers written docs, without growing memory
+            self._written_docs.update(ids)
+        self._pending_docs = dict()
+        self._pending_files = []
 
-    def process_file_ctx(self, file: FileContext, collection: Collection, ctx: RuntimeContext):
+    def embedding_name(self) -> str:
+        """ identity of the embedding backend, for caching embeddings """
+        self.init_chroma()
+        if isinstance(self.embedding_function, SentenceTransformerEmbeddingFunction):
+            return self.config.st_model_name
+        return type(self.embedding_function).__name__
+
+    def scoped_where(self, where: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        """ limit the query inside current repo if repo_name set """
+        if not self.config.repo_name:
+            return where
+
+        repo_where = {MetadataConstant.KEY_REPO: self.config.repo_name}
+        if not where:
+            return repo_where
+        return {"$and": [where, repo_where]}
+
+    def doc_count(self) -> int:
+        self.init_chroma()
+        if not self.config.repo_name:
+            return self.chromadb_collection.count()
+        return len(self.chromadb_collection.get(where=self.scoped_where({}), include=[])["ids"])
+
+    def share_backend(self, other: "Storage"):
+        """ reuse the db client, collection and embedding backend of another storage """
+        other.init_chroma()
+        self.chromadb = other.chromadb
+        self.chromadb_collection = other.chromadb_collection
+        self.embedding_function = other.embedding_function
+
+    def process_file_ctx(self, file: FileContext, collection: "Collection", ctx: RuntimeContext):
         process_dict = {
             MetadataConstant.DATA_TYPE_ISSUE: self.process_issue,
             MetadataConstant.DATA_TYPE_COMMIT_MSG: self.process_commit_msg
@@ -164,9 +349,50 @@ class Storage(object):
         self.process_file_ctx(file, self.chromadb_collection, ctx)
 
     def embed_ctx(self, ctx: RuntimeContext):
-        self.init_chroma()
+        # before loading the model, which is profiled too
         self.relations = ctx.relations
+        self.spilled_relations = ctx.spilled_relations
+        self.profile = ctx.profile
+        self.init_chroma()
+        if self.config.checkpoint and self.config.db_path:
+            self.checkpoint = CheckpointJournal(
+                CheckpointJournal.path_of(self.config.db_path, self.config.repo_name)
+            )
+            finished = self.checkpoint.file_count()
+            if finished:
+                logger.info(f"resume from checkpoint, skip {finished} finished files")
+
+        self._pending_docs = dict()
+        self._pending_files = []
+        self._written_docs = set()
         logger.info("start embedding source files")
-        for each_file in tqdm(ctx.files.values()):
-            self.embed_file(each_file, ctx)
+        try:
+            for each_file in tqdm(ctx.files.values()):
+                if self.checkpoint and self.checkpoint.has_file(each_file.name):
+                    continue
+                self.embed_file(each_file, ctx)
+                self._pending_files.append(each_file.name)
+                if len(self._pending_docs) >= self.config.write_batch_size:
+                    self.flush_docs()
+            self.flush_docs()
+        finally:
+            self._pending_docs = None
+            self._written_docs = set()
+            if self.checkpoint:
+                self.checkpoint.close()
+
+        # one file for fast loading
+        self.persist(compact=True)
+        # all done, the next run starts from scratch
+        if self.checkpoint:
+            self.checkpoint.remove()
+            self.checkpoint = None
         logger.info("embedding finished")
+
+    def persist(self, compact: bool = False):
+        """
+        chroma persists itself, numpy backend writes files to db_path.
+        only the docs written since the last call are appended, `compact` merges them into one file.
+        """
+        if isinstance(self.chromadb_collection, NumpyCollection):
+            self.chromadb_collection.save(compact=compact)
@@ -1,3 +1,5 @@
+import json
+import os
 import typing
 from collections import OrderedDict
 
@@ -5,22 +7,29 @@ import networkx
 import networkx as nx
 import numpy as np
 import pandas as pd
-from chromadb import QueryResult, Metadata
 from loguru import logger
 from pandas import Index
 from pydantic_settings import BaseSettings
 from tqdm import tqdm
 
+from srctag.profile import Profile, ProfileStage
+from srctag.scores import SparseScores
 from srctag.storage import Storage, MetadataConstant
+from srctag.vectorstore import sq_l2_distances
+
+if typing.TYPE_CHECKING:
+    from chromadb import QueryResult, Metadata
 
 
 class TagResult(object):
-    def __init__(self, scores_df: pd.DataFrame):
+    def __init__(self, scores_df: pd.DataFrame, profile: Profile = None):
         self.scores_df = scores_df
+        self.profile = profile or Profile()
 
     def export_csv(self, path: str = "srctag-output.csv") -> None:
         logger.info(f"dump result to csv: {path}")
-        self.scores_df.to_csv(path)
+        with self.profile.stage(ProfileStage.EXPORT, count=len(self.scores_df)):
+            self.scores_df.to_csv(path)
 
     def export_networkx(self) -> nx.Graph:
         df = self.scores_df.fillna(0)
@@ -39,9 +48,10 @@ class TagResult(object):
         return g
 
     def export_dot(self, path: str):
-        graph = self.export_networkx()
-        logger.info(f"dump result to dot: {path}")
-        networkx.drawing.nx_pydot.write_dot(graph, path)
+        with self.profile.stage(ProfileStage.EXPORT, count=len(self.scores_df)):
+            graph = self.export_networkx()
+            logger.info(f"dump result to dot: {path}")
+            networkx.drawing.nx_pydot.write_dot(graph, path)
 
     @classmethod
     def import_csv(cls, path: str) -> "TagResult":
@@ -74,6 +84,43 @@ class TagResult(object):
         return origin / len(self.files())
 
 
+class TagEmbeddingStore(object):
+    """ tag embeddings keyed by model name and tag text, persisted as a json file """
+
+    FILE_NAME = "srctag-tag-embeddings.json"
+
+    def __init__(self, path: str = ""):
+        self.path = path
+        # model name -> tag -> embedding
+        self.data: typing.Dict[str, typing.Dict[str, typing.List[float]]] = dict()
+        if path and os.path.isfile(path):
+            with open(path) as f:
+                self.data = json.load(f)
+            logger.info(f"load tag embeddings from {path}")
+
+    @classmethod
+    def path_of(cls, db_path: str) -> str:
+        if not db_path:
+            # in-memory only
+            return ""
+        return os.path.join(db_path, cls.FILE_NAME)
+
+    def get(self, model_name: str, tag: str) -> typing.Optional[typing.List[float]]:
+        return self.data.get(model_name, dict()).get(tag)
+
+    def update(self, model_name: str, embeddings: typing.Dict[str, typing.List[float]]):
+        model_data = self.data.setdefault(model_name, dict())
+        for each_tag, each_embedding in embeddings.items():
+            model_data[each_tag] = [float(x) for x in each_embedding]
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(self.data, f)
+
+
 class TaggerConfig(BaseSettings):
     tags: typing.Set[str] = set()
 
@@ -86,6 +133,17 @@ class TaggerConfig(BaseSettings):
     # normalization or rank
     normalize: bool = True
 
+    # tags per query call
+    query_batch_size: int = 16
+
+    # query commit msgs and issues together, and merge them with weights
+    fused: bool = False
+    commit_weight: float = 1.0
+    issue_weight: float = 1.0
+
+    # scores_df with sparse columns (NaN as fill value), for huge repos
+    sparse_output: bool = False
+
 
 class Tagger(object):
     """
@@ -100,155 +158,213 @@ class Tagger(object):
             config = TaggerConfig()
         self.config = config
 
-    def tag_with_commit(self, storage: Storage) -> TagResult:
-        doc_count = storage.chromadb_collection.count()
-        n_results = int(doc_count * self.config.n_percent)
+        # reused between queries and runs, persisted alongside storage db_path
+        self.tag_embedding_store: typing.Optional[TagEmbeddingStore] = None
+
+    def embed_tags(self, storage: Storage) -> typing.Dict[str, typing.List[float]]:
+        """ embed tags with the storage embedding backend, only the unseen tags will be embedded """
+        store_path = TagEmbeddingStore.path_of(storage.config.db_path)
+        if not self.tag_embedding_store or self.tag_embedding_store.path != store_path:
+            self.tag_embedding_store = TagEmbeddingStore(store_path)
+        store = self.tag_embedding_store
+        model_name = storage.embedding_name()
+
+        missing = [each for each in self.config.tags if store.get(model_name, each) is None]
+        if missing:
+            with storage.profile.stage(ProfileStage.EMBEDDING, count=len(missing)):
+                embeddings = storage.embedding_function(missing)
+            store.update(model_name, dict(zip(missing, embeddings)))
+            store.save()
+        return {each: store.get(model_name, each) for each in self.config.tags}
+
+    def _query(self, storage: Storage, tag_embeddings: typing.Dict[str, typing.List[float]],
+               data_types: typing.List[str]) -> typing.List[typing.Tuple[str, "Metadata", float]]:
+        """ search related docs for tags, batched. returns (tag, doc metadata, score) """
+        if len(data_types) == 1:
+            where = {MetadataConstant.KEY_DATA_TYPE: data_types[0]}
+        else:
+            where = {MetadataConstant.KEY_DATA_TYPE: {"$in": data_types}}
 
-        tag_results = []
+        doc_count = storage.doc_count()
+        n_results = int(doc_count * self.config.n_percent)
+        where = storage.scoped_where(where)
+
+        tags = list(tag_embeddings.keys())
+        batch_size = self.config.query_batch_size
+        hits = []
+        for i in tqdm(range(0, len(tags), batch_size)):
+            batch_tags = tags[i: i + batch_size]
+            with storage.profile.stage(ProfileStage.QUERY, count=len(batch_tags)):
+                query_result: "QueryResult" = storage.chromadb_collection.query(
+                    query_embeddings=[tag_embeddings[each] for each in batch_tags],
+                    n_results=n_results,
+                    include=["metadatas", "distances"],
+                    where=where,
+                )
+
+            for each_tag, metadatas, distances in zip(
+                    batch_tags, query_result["metadatas"], query_result["distances"]
+            ):
+                # https://github.com/langchain-ai/langchain/blob/master/libs/langchain/langchain/vectorstores/chroma.py
+                # https://stats.stackexchange.com/questions/158279/how-i-can-convert-distance-euclidean-to-similarity-score
+                for each_metadata, each_distance in zip(metadatas, distances):
+                    hits.append((each_tag, each_metadata, 1.0 / (1.0 + each_distance)))
+            # END tag loop
+        # END batch loop
+        return hits
+
+    def _aggregate(self, storage: Storage, hits: typing.List[typing.Tuple[str, "Metadata", float]],
+                   weights: typing.Dict[str, float] = None) -> TagResult:
+        """ merge doc hits into file scores. commit hits go to its source, issue hits go to related files """
         relation_graph = storage.relations.copy()
-        for each_tag in tqdm(self.config.tags):
-            query_result: QueryResult = storage.chromadb_collection.query(
-                query_texts=each_tag,
-                n_results=n_results,
-                include=["metadatas", "distances"],
-                where={MetadataConstant.KEY_DATA_TYPE: MetadataConstant.DATA_TYPE_COMMIT_MSG}
-            )
-
-            metadatas: typing.List[Metadata] = query_result["metadatas"][0]
-            # https://github.com/langchain-ai/langchain/blob/master/libs/langchain/langchain/vectorstores/chroma.py
-            # https://stats.stackexchange.com/questions/158279/how-i-can-convert-distance-euclidean-to-similarity-score
-            distances: typing.List[float] = query_result["distances"][0]
-            normalized_scores = [
-                1.0 / (1.0 + x) for x in distances
-            ]
-
-            for each_metadata, each_score in zip(metadatas, normalized_scores):
-                each_file_name = each_metadata[MetadataConstant.KEY_SOURCE]
-                tag_results.append((each_tag, each_file_name, each_score))
-            # END file loop
-        # END tag loop
-
-        ret = dict()
-        for each_tag, each_file_name, each_score in tag_results:
-            if each_file_name not in ret:
-                # has not been touched by other tags
-                # the score order is decreasing
-                ret[each_file_name] = OrderedDict()
-            each_file_tag_result = ret[each_file_name]
-
-            if each_tag not in each_file_tag_result:
-                each_file_tag_result[each_tag] = each_score
-            else:
-                # has been touched by other commits, merge
-                each_file_tag_result[each_tag] += each_score
-
-            # update graph
-            relation_graph.add_node(each_tag, node_type=MetadataConstant.KEY_TAG)
-            relation_graph.add_edge(each_tag, each_file_name)
-        # END tag_results
-
-        scores_df = pd.DataFrame.from_dict(ret, orient="index")
-        if self.config.optimize:
-            scores_df = self.optimize(scores_df)
+        with storage.profile.stage(ProfileStage.AGGREGATION, count=len(hits)):
+            ret = dict()
+            for each_tag, each_metadata, each_score in hits:
+                data_type = each_metadata[MetadataConstant.KEY_DATA_TYPE]
+                if weights:
+                    each_score *= weights.get(data_type, 1.0)
+
+                if data_type == MetadataConstant.DATA_TYPE_ISSUE:
+                    linked = each_metadata[MetadataConstant.KEY_ISSUE_ID]
+                    files = []
+                    if storage.spilled_relations:
+                        files = storage.spilled_relations.neighbors(linked)
+                        # only files are kept in the graph
+                        relation_graph.add_node(linked, node_type=MetadataConstant.KEY_ISSUE_ID)
+                    elif storage.relations.has_node(linked):
+                        files = [
+                            each for each in storage.relations.neighbors(linked)
+                            if storage.relations.nodes[each].get("node_type") == MetadataConstant.KEY_SOURCE
+                        ]
+                else:
+                    linked = each_metadata[MetadataConstant.KEY_SOURCE]
+                    files = [linked]
+
+                for each_file in files:
+                    if each_file not in ret:
+                        # has not been touched by other tags
+                        # the score order is decreasing
+                        ret[each_file] = OrderedDict()
+                    each_file_tag_result = ret[each_file]
+
+                    if each_tag not in each_file_tag_result:
+                        each_file_tag_result[each_tag] = each_score
+                    else:
+                        # has been touched by other commits, merge
+                        each_file_tag_result[each_tag] += each_score
 
-        # convert score matrix into rank (use reversed rank as score). because:
-        # 1. score/distance is meaningless to users
-        # 2. can not be evaluated both rows and cols
-        scores_df = scores_df.rank(axis=0, method='min')
+                # update graph
+                relation_graph.add_node(each_tag, node_type=MetadataConstant.KEY_TAG)
+                relation_graph.add_edge(each_tag, linked)
+            # END hits
 
-        if self.config.normalize:
-            scores_df = (scores_df - scores_df.min()) / (scores_df.max() - scores_df.min())
+            scores_df = self._post_process(SparseScores.from_nested_dict(ret))
 
         logger.info(f"tag finished")
         # update relation graph in storage
         storage.relations = relation_graph
+        return TagResult(scores_df=scores_df, profile=storage.profile)
 
-        return TagResult(scores_df=scores_df)
-
-    def tag_with_issue(self, storage: Storage) -> TagResult:
-        doc_count = storage.chromadb_collection.count()
-        n_results = int(doc_count * self.config.n_percent)
-
-        tag_results = []
-        relation_graph = storage.relations.copy()
-        for each_tag in tqdm(self.config.tags):
-            query_result: QueryResult = storage.chromadb_collection.query(
-                query_texts=each_tag,
-                n_results=n_results,
-                include=["metadatas", "distances"],
-                where={MetadataConstant.KEY_DATA_TYPE: MetadataConstant.DATA_TYPE_ISSUE}
-            )
-
-            metadatas: typing.List[Metadata] = query_result["metadatas"][0]
-            # https://github.com/langchain-ai/langchain/blob/master/libs/langchain/langchain/vectorstores/chroma.py
-            # https://stats.stackexchange.com/questions/158279/how-i-can-convert-distance-euclidean-to-similarity-score
-            distances: typing.List[float] = query_result["distances"][0]
-            normalized_scores = [
-                1.0 / (1.0 + x) for x in distances
-            ]
-
-            for each_metadata, each_score in zip(metadatas, normalized_scores):
-                each_issue_id = each_metadata[MetadataConstant.KEY_ISSUE_ID]
-                tag_results.append((each_tag, each_issue_id, each_score))
-            # END file loop
-        # END tag loop
-
-        ret = dict()
-        for each_tag, each_issue_id, each_score in tag_results:
-            files = storage.relations.neighbors(each_issue_id)
-            for each_file in files:
-                if each_file not in ret:
-                    # has not been touched by other tags
-                    # the score order is decreasing
-                    ret[each_file] = OrderedDict()
-                each_file_tag_result = ret[each_file]
-
-                if each_tag not in each_file_tag_result:
-                    each_file_tag_result[each_tag] = each_score
-                else:
-                    # has been touched by other commits, merge
-                    each_file_tag_result[each_tag] += each_score
-
-                # update graph
-                relation_graph.add_node(each_tag, node_type=MetadataConstant.KEY_TAG)
-                relation_graph.add_edge(each_tag, each_issue_id)
-        # END tag_results
-
-        scores_df = pd.DataFrame.from_dict(ret, orient="index")
+    def _post_process(self, scores: SparseScores) -> pd.DataFrame:
+        # works on the scored cells only, same values as the dense version:
+        # optimize -> df.rank(axis=0, method='min') -> min-max normalization
         if self.config.optimize:
-            scores_df = self.optimize(scores_df)
+            scores = self.optimize(scores)
 
         # convert score matrix into rank (use reversed rank as score). because:
         # 1. score/distance is meaningless to users
         # 2. can not be evaluated both rows and cols
-        scores_df = scores_df.rank(axis=0, method='min')
+        scores.rank()
 
         if self.config.normalize:
-            scores_df = (scores_df - scores_df.min()) / (scores_df.max() - scores_df.min())
-
-        logger.info(f"tag finished")
-        # update relation graph in storage
-        storage.relations = relation_graph
-        return TagResult(scores_df=scores_df)
+            scores.normalize()
+        return scores.to_dataframe(sparse=self.config.sparse_output)
+
+    def tag_with_commit(self, storage: Storage,
+                        tag_embeddings: typing.Dict[str, typing.List[float]] = None) -> TagResult:
+        if tag_embeddings is None:
+            tag_embeddings = self.embed_tags(storage)
+        hits = self._query(storage, tag_embeddings, [MetadataConstant.DATA_TYPE_COMMIT_MSG])
+        return self._aggregate(storage, hits)
+
+    def tag_with_issue(self, storage: Storage,
+                       tag_embeddings: typing.Dict[str, typing.List[float]] = None) -> TagResult:
+        if tag_embeddings is None:
+            tag_embeddings = self.embed_tags(storage)
+        hits = self._query(storage, tag_embeddings, [MetadataConstant.DATA_TYPE_ISSUE])
+        return self._aggregate(storage, hits)
+
+    def tag_fused(self, storage: Storage,
+                  tag_embeddings: typing.Dict[str, typing.List[float]] = None) -> TagResult:
+        """ commit msgs and issues in one search, with weighted merge """
+        if tag_embeddings is None:
+            tag_embeddings = self.embed_tags(storage)
+        hits = self._query(
+            storage, tag_embeddings, [MetadataConstant.DATA_TYPE_COMMIT_MSG, MetadataConstant.DATA_TYPE_ISSUE]
+        )
+        weights = {
+            MetadataConstant.DATA_TYPE_COMMIT_MSG: self.config.commit_weight,
+            MetadataConstant.DATA_TYPE_ISSUE: self.config.issue_weight,
+        }
+        return self._aggregate(storage, hits, weights)
+
+    def tag_files(self, storage: Storage, files: typing.Iterable[str],
+                  tag_embeddings: typing.Dict[str, typing.List[float]] = None) -> TagResult:
+        """
+        tag some files only, with the commit msgs already embedded in storage (e.g. a persisted db_path).
+        docs are picked by their source instead of searching the whole collection,
+        and scored with their stored embeddings.
+        """
+        storage.init_chroma()
+        if tag_embeddings is None:
+            tag_embeddings = self.embed_tags(storage)
+        files = list(files)
+
+        where = storage.scoped_where({"$and": [
+            {MetadataConstant.KEY_DATA_TYPE: MetadataConstant.DATA_TYPE_COMMIT_MSG},
+            {MetadataConstant.KEY_SOURCE: {"$in": files}},
+        ]})
+        tags = list(tag_embeddings.keys())
+        hits = []
+        with storage.profile.stage(ProfileStage.QUERY, count=len(tags)):
+            docs = storage.chromadb_collection.get(where=where, include=["embeddings", "metadatas"])
+            found = {each[MetadataConstant.KEY_SOURCE] for each in docs["metadatas"]}
+            for each in files:
+                if each not in found:
+                    logger.warning(f"no docs found in storage: {each}")
+
+            if docs["ids"] and tags:
+                distances = sq_l2_distances(
+                    np.asarray([tag_embeddings[each] for each in tags], dtype=np.float32),
+                    np.asarray(docs["embeddings"], dtype=np.float32),
+                )
+                # same as _query, closest n_percent docs of each tag
+                n_results = max(1, int(len(docs["ids"]) * self.config.n_percent))
+                for each_tag, each_distances in zip(tags, distances):
+                    top = np.argsort(each_distances, kind="stable")[:n_results]
+                    for i in top:
+                        hits.append((each_tag, docs["metadatas"][i], 1.0 / (1.0 + float(each_distances[i]))))
+        return self._aggregate(storage, hits)
 
     def tag(self, storage: Storage) -> TagResult:
         logger.info(f"start tagging source files ...")
         storage.init_chroma()
+        return self.tag_with_embeddings(storage, self.embed_tags(storage))
 
-        if storage.config.issue_mapping:
+    def tag_with_embeddings(self, storage: Storage, tag_embeddings: typing.Dict[str, typing.List[float]]) -> TagResult:
+        """ tag with precomputed query vectors, tag -> embedding """
+        storage.init_chroma()
+        if self.config.fused:
+            logger.info("tag with commit and issue")
+            return self.tag_fused(storage, tag_embeddings)
+        elif storage.config.has_issues():
             logger.info("tag with issue")
-            return self.tag_with_issue(storage)
+            return self.tag_with_issue(storage, tag_embeddings)
         else:
             logger.info("tag with commit")
-            return self.tag_with_commit(storage)
-
-    def optimize(self, df: pd.DataFrame) -> pd.DataFrame:
-        scale_factor = 2.0
-        df = np.exp(df * scale_factor)
+            return self.tag_with_commit(storage, tag_embeddings)
 
+    def optimize(self, scores: SparseScores) -> SparseScores:
+        """ can be overwritten for custom score optimization, before ranking """
         # reduce the impacts of common files
-        row_variances = df.var(axis=1)
-        max_variance = row_variances.max()
-        weights = 1.0 - row_variances / max_variance
-        df = df.multiply(weights, axis=0)
-        return df
+        return scores.optimize()
@@ -0,0 +1,358 @@
+import json
+import os
+import typing
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from srctag.model import SrcTagException
+
+
+def sq_l2_distances(queries: np.ndarray, data: np.ndarray, data_norms: np.ndarray = None) -> np.ndarray:
+    """ squared l2 distances, queries x data """
+    if data_norms is None:
+        data_norms = np.einsum("ij,ij->i", data, data)
+    query_norms = np.einsum("ij,ij->i", queries, queries)
+    distances = query_norms[:, None] - 2.0 * (queries @ data.T) + data_norms[None, :]
+    return np.maximum(distances, 0.0)
+
+
+class NumpyCollection(object):
+    """
+    chroma-free collection, with the subset of chroma collection API used by srctag
+
+    - embeddings in one numpy matrix, metadata in parallel arrays (one column per key)
+    - distance: squared l2, same as chroma `hnsw:space=l2`
+    - exact search by default, IVF (inverted file, k-means lists) when nlist > 0
+    - persisted inside path as segments (`<name>.<n>.npy` + `<name>.<n>.json`) listed in `<name>.json`.
+      saving appends the rows added since the last save as a new segment, and rewrites everything
+      into one segment only when saved rows changed or `compact` is set. embeddings loaded with mmap
+    """
+
+    def __init__(self, name: str, path: str = "", nlist: int = 0, nprobe: int = 8):
+        self.name = name
+        self.path = path
+        self.nlist = nlist
+        self.nprobe = nprobe
+
+        self.ids: typing.List[str] = []
+        self.id_index: typing.Dict[str, int] = dict()
+        self.documents: typing.List[str] = []
+        # key -> values, None for missing
+        self.columns: typing.Dict[str, typing.List[typing.Any]] = dict()
+        self.embeddings: typing.Optional[np.ndarray] = None
+        # rows added but not concatenated into embeddings yet
+        self._pending: typing.List[np.ndarray] = []
+
+        # persisted segments, and rows covered by them
+        self._segments: typing.List[str] = []
+        self._saved_rows = 0
+        # saved rows updated, segments have to be rewritten
+        self._saved_dirty = False
+
+        # caches, dropped after writing
+        self._column_arrays: typing.Dict[str, np.ndarray] = dict()
+        self._norms: typing.Optional[np.ndarray] = None
+        self._centroids: typing.Optional[np.ndarray] = None
+        self._lists: typing.List[np.ndarray] = []
+
+        if path and os.path.isfile(self._manifest_file()):
+            self.load()
+
+    def _manifest_file(self) -> str:
+        return os.path.join(self.path, f"{self.name}.json")
+
+    def _segment_files(self, segment: str) -> typing.Tuple[str, str]:
+        return os.path.join(self.path, f"{segment}.npy"), os.path.join(self.path, f"{segment}.json")
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def add(self, ids: typing.List[str], embeddings: typing.List[typing.List[float]],
+            metadatas: typing.List[typing.Dict[str, typing.Any]] = None, documents: typing.List[str] = None):
+        duplicated = [each for each in ids if each in self.id_index]
+        if duplicated:
+            raise SrcTagException(f"ids already exist: {duplicated[:3]}")
+        self.upsert(ids, embeddings, metadatas, documents)
+
+    def upsert(self, ids: typing.List[str], embeddings: typing.List[typing.List[float]],
+               metadatas: typing.List[typing.Dict[str, typing.Any]] = None, documents: typing.List[str] = None):
+        if not ids:
+            return
+        if len(set(ids)) != len(ids):
+            raise SrcTagException("duplicated ids in one write")
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        metadatas = metadatas or [dict() for _ in ids]
+        documents = documents or [""] * len(ids)
+
+        new_rows = []
+        for row, (each_id, each_metadata, each_document) in enumerate(zip(ids, metadatas, documents)):
+            index = self.id_index.get(each_id)
+            if index is None:
+                index = len(self.ids)
+                self.id_index[each_id] = index
+                self.ids.append(each_id)
+                self.documents.append(each_document)
+                for each_column in self.columns.values():
+                    each_column.append(None)
+                new_rows.append(row)
+            else:
+                if index < self._saved_rows:
+                    self._saved_dirty = True
+                self._flush_pending()
+                if not self.embeddings.flags.writeable:
+                    # loaded with mmap
+                    self.embeddings = np.array(self.embeddings)
+                self.embeddings[index] = vectors[row]
+                self.documents[index] = each_document
+                for each_column in self.columns.values():
+                    each_column[index] = None
+
+            for key, value in each_metadata.items():
+                if key not in self.columns:
+                    self.columns[key] = [None] * len(self.ids)
+                self.columns[key][index] = value
+
+        if new_rows:
+            self._pending.append(vectors[new_rows])
+        self._invalidate()
+
+    def _invalidate(self):
+        self._column_arrays = dict()
+        self._norms = None
+        self._centroids = None
+        self._lists = []
+
+    def _flush_pending(self):
+        if not self._pending:
+            return
+        if self.embeddings is not None and len(self.embeddings):
+            self._pending.insert(0, self.embeddings)
+        self.embeddings = np.concatenate(self._pending)
+        self._pending = []
+
+    def _column(self, key: str) -> np.ndarray:
+        if key not in self._column_arrays:
+            values = self.columns.get(key, [None] * len(self.ids))
+            arr = np.empty(len(values), dtype=object)
+            arr[:] = values
+            self._column_arrays[key] = arr
+        return self._column_arrays[key]
+
+    def _metadata(self, index: int) -> typing.Dict[str, typing.Any]:
+        return {key: values[index] for key, values in self.columns.items() if values[index] is not None}
+
+    def _mask(self, where: typing.Dict[str, typing.Any]) -> np.ndarray:
+        """ chroma style where: `{k: v}`, `{k: {"$eq"|"$ne"|"$in"|"$nin": v}}`, `$and`, `$or` """
+        mask = np.ones(len(self.ids), dtype=bool)
+        for key, cond in (where or dict()).items():
+            if key == "$and":
+                for each in cond:
+                    mask &= self._mask(each)
+            elif key == "$or":
+                any_mask = np.zeros(len(self.ids), dtype=bool)
+                for each in cond:
+                    any_mask |= self._mask(each)
+                mask &= any_mask
+            else:
+                column = self._column(key)
+                if not isinstance(cond, dict):
+                    cond = {"$eq": cond}
+                for op, value in cond.items():
+                    if op == "$eq":
+                        mask &= column == value
+                    elif op == "$ne":
+                        mask &= column != value
+                    elif op in ("$in", "$nin"):
+                        # hash based, works with None and mixed types
+                        is_in = pd.Series(column, dtype=object).isin(list(value)).to_numpy()
+                        mask &= is_in if op == "$in" else ~is_in
+                    else:
+                        raise SrcTagException(f"unsupported where operator: {op}")
+        return mask
+
+    def get(self, ids: typing.List[str] = None, where: typing.Dict[str, typing.Any] = None,
+            include: typing.List[str] = ("metadatas", "documents")) -> typing.Dict[str, typing.Any]:
+        mask = self._mask(where)
+        if ids is not None:
+            id_mask = np.zeros(len(self.ids), dtype=bool)
+            id_mask[[self.id_index[each] for each in ids if each in self.id_index]] = True
+            mask &= id_mask
+        indexes = np.flatnonzero(mask)
+
+        ret = {"ids": [self.ids[i] for i in indexes]}
+        if "metadatas" in include:
+            ret["metadatas"] = [self._metadata(i) for i in indexes]
+        if "documents" in include:
+            ret["documents"] = [self.documents[i] for i in indexes]
+        if "embeddings" in include:
+            self._flush_pending()
+            ret["embeddings"] = self.embeddings[indexes].tolist() if len(indexes) else []
+        return ret
+
+    def _build_ivf(self, iterations: int = 10):
+        """ k-means on (a sample of) the embeddings, one inverted list per centroid """
+        data = self.embeddings
+        nlist = min(self.nlist, len(data))
+        rng = np.random.default_rng(42)
+        sample = data
+        if len(data) > nlist * 256:
+            sample = data[rng.choice(len(data), nlist * 256, replace=False)]
+        centroids = np.array(sample[rng.choice(len(sample), nlist, replace=False)], dtype=np.float32)
+
+        for _ in range(iterations):
+            assign = self._nearest(sample, centroids)
+            for i in range(nlist):
+                members = sample[assign == i]
+                if len(members):
+                    centroids[i] = members.mean(axis=0)
+
+        assign = self._nearest(data, centroids)
+        self._centroids = centroids
+        self._lists = [np.flatnonzero(assign == i) for i in range(nlist)]
+        logger.debug(f"ivf built, {nlist} lists for {len(data)} vectors")
+
+    @staticmethod
+    def _nearest(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        return sq_l2_distances(data, centroids).argmin(axis=1)
+
+    def _candidates(self, query: np.ndarray, mask: np.ndarray, n_results: int) -> np.ndarray:
+        """ rows in the closest lists, probe more lists if not enough for n_results """
+        order = sq_l2_distances(query[None, :], self._centroids)[0].argsort()
+        found = []
+        total = 0
+        for probed, each in enumerate(order):
+            if probed >= self.nprobe and total >= n_results:
+                break
+            rows = self._lists[each]
+            rows = rows[mask[rows]]
+            found.append(rows)
+            total += len(rows)
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def query(self, query_embeddings: typing.List[typing.List[float]], n_results: int = 10,
+              where: typing.Dict[str, typing.Any] = None,
+              include: typing.List[str] = ("metadatas", "documents", "distances")) -> typing.Dict[str, typing.Any]:
+        self._flush_pending()
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        mask = self._mask(where)
+
+        ret = {"ids": []}
+        for each in include:
+            ret[each] = []
+        if not len(self.ids):
+            for key in ret:
+                ret[key] = [[] for _ in queries]
+            return ret
+
+        if self._norms is None:
+            self._norms = np.einsum("ij,ij->i", self.embeddings, self.embeddings)
+
+        if self.nlist > 0:
+            if self._centroids is None:
+                self._build_ivf()
+            candidates_list = [self._candidates(each, mask, n_results) for each in queries]
+            distances_list = [
+                sq_l2_distances(each[None, :], self.embeddings[rows], self._norms[rows])[0]
+                for each, rows in zip(queries, candidates_list)
+            ]
+        else:
+            rows = np.flatnonzero(mask)
+            distances = sq_l2_distances(queries, self.embeddings[rows], self._norms[rows])
+            candidates_list = [rows] * len(queries)
+            distances_list = list(distances)
+
+        for rows, distances in zip(candidates_list, distances_list):
+            k = min(n_results, len(rows))
+            if k <= 0:
+                top = np.empty(0, dtype=np.int64)
+            else:
+                top = np.argpartition(distances, k - 1)[:k]
+                top = top[np.argsort(distances[top], kind="stable")]
+
+            ret["ids"].append([self.ids[rows[i]] for i in top])
+            if "metadatas" in include:
+                ret["metadatas"].append([self._metadata(rows[i]) for i in top])
+            if "documents" in include:
+                ret["documents"].append([self.documents[rows[i]] for i in top])
+            if "distances" in include:
+                ret["distances"].append(distances[top].tolist())
+        return ret
+
+    def save(self, compact: bool = False):
+        if not self.path:
+            return
+        self._flush_pending()
+        os.makedirs(self.path, exist_ok=True)
+
+        appending = self._saved_rows < len(self.ids)
+        rewrite = self._saved_dirty or compact and len(self._segments) + appending > 1
+        start = 0 if rewrite else self._saved_rows
+        if start == len(self.ids) and not rewrite and os.path.isfile(self._manifest_file()):
+            return
+
+        old_segments = self._segments if rewrite else []
+        segments = [] if rewrite else list(self._segments)
+        if start < len(self.ids):
+            segments.append(self._write_segment(start))
+        # manifest replaced last, an interrupted save keeps the previous state
+        with open(f"{self._manifest_file()}.tmp", "w") as f:
+            json.dump({"segments": segments}, f)
+        os.replace(f"{self._manifest_file()}.tmp", self._manifest_file())
+        for each in old_segments:
+            for each_file in self._segment_files(each):
+                os.remove(each_file)
+
+        self._segments = segments
+        self._saved_rows = len(self.ids)
+        self._saved_dirty = False
+        logger.info(f"save {len(self.ids) - start} of {self.count()} docs to {self.path}, {len(segments)} segments")
+
+    def _write_segment(self, start: int) -> str:
+        """ rows from start, into a new segment never mapped by anyone """
+        number = 0
+        if self._segments:
+            number = max(int(each.rsplit(".", 1)[1]) for each in self._segments) + 1
+        segment = f"{self.name}.{number}"
+        data_file, meta_file = self._segment_files(segment)
+        with open(data_file, "wb") as f:
+            np.save(f, self.embeddings[start:])
+        with open(meta_file, "w") as f:
+            json.dump({
+                "ids": self.ids[start:],
+                "documents": self.documents[start:],
+                "columns": {key: values[start:] for key, values in self.columns.items()},
+            }, f)
+        return segment
+
+    def load(self):
+        with open(self._manifest_file()) as f:
+            self._segments = json.load(f)["segments"]
+
+        self.ids = []
+        self.documents = []
+        self.columns = dict()
+        parts = []
+        for each in self._segments:
+            data_file, meta_file = self._segment_files(each)
+            with open(meta_file) as f:
+                meta = json.load(f)
+            for key, values in meta["columns"].items():
+                if key not in self.columns:
+                    self.columns[key] = [None] * len(self.ids)
+                self.columns[key].extend(values)
+            self.ids.extend(meta["ids"])
+            self.documents.extend(meta["documents"])
+            for values in self.columns.values():
+                values.extend([None] * (len(self.ids) - len(values)))
+            parts.append(np.load(data_file, mmap_mode="r"))
+
+        self.id_index = {each: i for i, each in enumerate(self.ids)}
+        # one segment stays mapped
+        self.embeddings = parts[0] if len(parts) == 1 else np.concatenate(parts) if parts else None
+        self._pending = []
+        self._saved_rows = len(self.ids)
+        self._saved_dirty = False
+        self._invalidate()
+        logger.info(f"load {self.count()} docs from {self.path}, {len(self._segments)} segments")
@@ -0,0 +1,12 @@
+from srctag.benchmark import BenchmarkConfig, run_benchmark, compare
+
+
+def test_benchmark():
+    config = BenchmarkConfig(file_count=20, dir_count=4, commit_count=50, tag_count=3)
+    result = run_benchmark(config)
+
+    for each in ("collect_dfs", "collect_bfs", "embed", "tag"):
+        assert result["results"][each]["items"] > 0
+        assert result["results"][each]["peak_rss"] > 0
+    assert result["results"]["collect_dfs"]["items"] == result["results"]["collect_bfs"]["items"]
+    assert not compare(result, result)
@@ -0,0 +1,53 @@
+import networkx as nx
+
+from srctag.cochange import CoChangeMatrix
+from srctag.storage import MetadataConstant
+
+
+def _relations() -> nx.Graph:
+    g = nx.Graph()
+    for each in ("a.py", "b.py", "c.py", "d.py"):
+        g.add_node(each, node_type=MetadataConstant.KEY_SOURCE)
+    # c1 is 10 days older than c2 and c3
+    g.add_node("c1", node_type=MetadataConstant.KEY_COMMIT_SHA, timestamp=0)
+    g.add_node("c2", node_type=MetadataConstant.KEY_COMMIT_SHA, timestamp=10 * 86400)
+    g.add_node("c3", node_type=MetadataConstant.KEY_COMMIT_SHA, timestamp=10 * 86400)
+    g.add_node("#1", node_type=MetadataConstant.KEY_ISSUE_ID)
+    g.add_edges_from([
+        ("c1", "a.py"), ("c1", "b.py"),
+        ("c2", "a.py"), ("c2", "b.py"), ("c2", "c.py"),
+        ("c3", "a.py"), ("c3", "c.py"),
+        ("#1", "a.py"), ("#1", "d.py"),
+    ])
+    return g
+
+
+def test_cochange_weights():
+    matrix = CoChangeMatrix.from_relations(_relations())
+    assert matrix.weight("a.py", "b.py") == 2.0
+    assert matrix.weight("a.py", "c.py") == 2.0
+    assert matrix.weight("a.py", "d.py") == 1.0
+    assert matrix.weight("b.py", "d.py") == 0.0
+    assert matrix.weight("a.py", "a.py") == 0.0
+    assert matrix.weight("a.py", "x.py") == 0.0
+    assert (matrix.matrix != matrix.matrix.T).nnz == 0
+
+
+def test_cochange_decay():
+    matrix = CoChangeMatrix.from_relations(_relations(), half_life_days=10)
+    assert matrix.weight("a.py", "b.py") == 1.5
+    assert matrix.weight("a.py", "c.py") == 2.0
+    # issues are not decayed
+    assert matrix.weight("a.py", "d.py") == 1.0
+
+
+def test_cochange_top_k():
+    matrix = CoChangeMatrix.from_relations(_relations(), half_life_days=10)
+    assert matrix.top_k_neighbors("a.py", 2) == [("c.py", 2.0), ("b.py", 1.5)]
+    assert matrix.top_k_neighbors("d.py", 5) == [("a.py", 1.0)]
+    assert matrix.top_k_neighbors("x.py", 5) == []
+
+    g = matrix.to_networkx(1)
+    assert set(g.neighbors("a.py")) == {"b.py", "c.py", "d.py"}
+    assert not g.has_edge("b.py", "c.py")
+    assert g.edges["a.py", "c.py"]["weight"] == 2.0
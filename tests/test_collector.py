@@ -1,9 +1,19 @@
 import os
+import re
+import subprocess
+import typing
 
+import git
 import networkx as nx
 from matplotlib import pyplot as plt
 
-from srctag.collector import Collector
+from srctag.benchmark import BenchmarkConfig, generate_repo
+from srctag.cochange import CoChangeMatrix
+from srctag.collector import Collector, FileLevelEnum, GitBatchReader, ScanRuleEnum
+from srctag.model import RuntimeContext
+from srctag.profile import ProfileStage
+from srctag.spill import SpillStore
+from srctag.storage import MetadataConstant
 
 
 def test_tagger_specific():
@@ -25,3 +35,228 @@ def test_relations():
     nx.draw(relations, with_labels=True, font_weight='bold', node_size=400,
             font_color='black', font_size=4, edge_color='gray', alpha=0.7)
     plt.savefig("my_graph.svg")
+
+
+def test_git_batch_reader():
+    repo = git.Repo(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    reader = GitBatchReader(repo.git_dir)
+    for each in repo.iter_commits(max_count=8):
+        assert reader.message(each.hexsha) == each.message
+        assert reader.changed_files(each.hexsha) == set(each.stats.files.keys())
+        assert reader.commit_time(each.hexsha) == each.committed_date
+    reader.close()
+
+
+def test_close(tmp_path):
+    for spill_path in ("", (tmp_path / "spill.db").as_posix()):
+        collector = Collector()
+        collector.config.repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        collector.config.spill_path = spill_path
+        ctx = collector.collect_metadata()
+        reader = ctx.git_reader
+        processes = [reader._cat_file, reader._diff_tree]
+        assert all(each.poll() is None for each in processes)
+        sha = next(iter(ctx.files["README.md"].commits)).hexsha
+
+        dir_ctx = ctx.roll_up()
+        ctx.close()
+        dir_ctx.close()
+        assert all(each.poll() is not None for each in processes)
+        # started again on demand
+        assert reader.message(sha)
+        reader.close()
+
+
+def test_commit_graph(tmp_path):
+    origin = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    repo_root = tmp_path / "repo"
+    git.Repo.clone_from(origin, repo_root)
+    graph_file = repo_root / ".git" / "objects" / "info" / "commit-graph"
+
+    # without changed-path bloom filters
+    subprocess.check_call(["git", "commit-graph", "write", "--reachable"], cwd=repo_root)
+    assert graph_file.is_file()
+    assert not Collector._has_bloom_filters(graph_file.as_posix())
+
+    collector = Collector()
+    collector.config.repo_root = repo_root.as_posix()
+    collector.config.use_commit_graph = True
+    ctx = collector.collect_metadata()
+    assert ctx.files
+    # regenerated with BDAT chunk
+    assert collector._commit_graph_files() == [graph_file.as_posix()]
+    assert Collector._has_bloom_filters(graph_file.as_posix())
+
+    # reused as is
+    mtime = graph_file.stat().st_mtime_ns
+    collector._prepare_commit_graph()
+    assert graph_file.stat().st_mtime_ns == mtime
+
+
+def test_dir_level():
+    collector = Collector()
+    collector.config.repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ctx = collector.collect_metadata()
+
+    dir_ctx = ctx.roll_up()
+    assert "srctag" in dir_ctx.files
+    assert len(dir_ctx.files) < len(ctx.files)
+    assert dir_ctx.relations.has_node("srctag")
+    # file level context untouched
+    assert "srctag/collector.py" in ctx.files
+
+    top_ctx = ctx.roll_up(depth=0)
+    assert list(top_ctx.files.keys()) == [""]
+    all_commits = {each.hexsha for each_file in ctx.files.values() for each in each_file.commits}
+    assert len(top_ctx.files[""].commits) == len(all_commits)
+
+
+def test_dir_level_include_dirs():
+    for each_rule in ScanRuleEnum:
+        collector = Collector()
+        collector.config.repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        collector.config.scan_rule = each_rule
+        collector.config.file_level = FileLevelEnum.DIR
+        collector.config.include_file_list = ["srctag", "tests"]
+        ctx = collector.collect_metadata()
+
+        # listed dirs are nodes themselves
+        assert sorted(ctx.files.keys()) == ["srctag", "tests"]
+        assert ctx.files["srctag"].commits
+        assert ctx.files["tests"].commits
+
+
+def test_time_window():
+    for each_rule in ScanRuleEnum:
+        collector = Collector()
+        collector.config.repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        collector.config.scan_rule = each_rule
+        collector.config.until = "2000-01-01"
+        ctx = collector.collect_metadata()
+        assert all(not each.commits for each in ctx.files.values())
+
+
+def test_profile():
+    collector = Collector()
+    collector.config.repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ctx = collector.collect_metadata()
+
+    stages = ctx.profile.to_dict()
+    for each in (ProfileStage.FILE_LISTING, ProfileStage.HISTORY_WALK,
+                 ProfileStage.DIFF_STATS, ProfileStage.RELATION_BUILDING):
+        assert stages[each]["calls"] > 0
+        assert stages[each]["wall_time"] >= 0
+        assert stages[each]["peak_rss_growth"] >= 0
+    assert stages[ProfileStage.FILE_LISTING]["count"] == len(ctx.files)
+
+
+def test_filters_in_scan_rules():
+    result = dict()
+    for each_rule in ScanRuleEnum:
+        collector = Collector()
+        collector.config.repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        collector.config.scan_rule = each_rule
+        collector.config.max_depth_limit = -1
+        collector.config.include_patterns = ["srctag/", "tests/"]
+        collector.config.exclude_patterns = ["__init__.py"]
+        collector.config.commit_include_regex = ".+"
+        ctx = collector.collect_metadata()
+        assert "srctag/collector.py" in ctx.files
+        assert "srctag/__init__.py" not in ctx.files
+        assert "README.md" not in ctx.files
+        result[each_rule] = {k: {each.hexsha for each in v.commits} for k, v in ctx.files.items()}
+    assert result[ScanRuleEnum.DFS] == result[ScanRuleEnum.BFS]
+
+
+def test_commit_include_regex(tmp_path):
+    repo_root = (tmp_path / "repo").as_posix()
+    generate_repo(repo_root, BenchmarkConfig(file_count=10, dir_count=2, commit_count=40, issue_density=0.5))
+    repo = git.Repo(repo_root)
+    # python re syntax, matched from the start, not supported by `git log --grep -E`
+    regex = r".+\(#\d+\)$"
+    matched = [each.hexsha for each in repo.iter_commits() if re.match(regex, each.message)]
+    assert 5 < len(matched) < 40
+
+    def _expected(file_name: str) -> typing.List[str]:
+        return [each.hexsha for each in repo.iter_commits(paths=file_name) if each.hexsha in matched]
+
+    for limit in (-1, 5):
+        result = dict()
+        for each_rule in ScanRuleEnum:
+            collector = Collector()
+            collector.config.repo_root = repo_root
+            collector.config.scan_rule = each_rule
+            collector.config.max_depth_limit = limit
+            collector.config.commit_include_regex = regex
+            ctx = collector.collect_metadata()
+            result[each_rule] = {k: [each.hexsha for each in v.commits] for k, v in ctx.files.items()}
+
+        # limit counted after filtering, per file in DFS, globally in BFS
+        top = set(matched if limit == -1 else matched[:limit])
+        for each_file, each_commits in result[ScanRuleEnum.DFS].items():
+            expected = _expected(each_file)
+            assert each_commits == (expected if limit == -1 else expected[:limit])
+            assert result[ScanRuleEnum.BFS][each_file] == [each for each in expected if each in top]
+        assert {each for v in result[ScanRuleEnum.BFS].values() for each in v} == top
+
+
+def _edges(ctx: RuntimeContext) -> typing.Set[typing.FrozenSet[str]]:
+    ret = {frozenset(each) for each in ctx.relations.edges}
+    if ctx.spilled_relations:
+        ret.update(frozenset((node, each_file)) for node, _, _, each_file in ctx.spilled_relations.edges())
+    return ret
+
+
+def _weights(cochange: CoChangeMatrix) -> typing.Dict[typing.Tuple[str, str], float]:
+    coo = cochange.matrix.tocoo()
+    # summed in different orders
+    return {(cochange.files[i], cochange.files[j]): round(v, 6) for i, j, v in zip(coo.row, coo.col, coo.data)}
+
+
+def test_spill(tmp_path):
+    for each_rule in ScanRuleEnum:
+        result = []
+        for spill_path in ("", (tmp_path / f"spill_{each_rule.value}.db").as_posix()):
+            collector = Collector()
+            collector.config.repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            collector.config.scan_rule = each_rule
+            collector.config.spill_path = spill_path
+            ctx = collector.collect_metadata()
+            commits = {k: [(each.hexsha, ctx.commit_message(each)) for each in v.commits] for k, v in ctx.files.items()}
+            if spill_path:
+                # commit and issue nodes are not in memory
+                assert {y for _, y in ctx.relations.nodes(data="node_type")} == {MetadataConstant.KEY_SOURCE}
+            dir_commits = []
+            # different depths from one collection
+            for depth in (None, 1, -1):
+                dir_ctx = ctx if depth is None else ctx.roll_up(depth=depth)
+                cochange = CoChangeMatrix.from_relations(
+                    dir_ctx.relations, half_life_days=10, spilled=dir_ctx.spilled_relations
+                )
+                dir_commits.append((
+                    {k: {each.hexsha for each in v.commits} for k, v in dir_ctx.files.items()},
+                    _edges(dir_ctx),
+                    _weights(cochange),
+                ))
+            result.append((commits, dir_commits))
+        assert result[0] == result[1]
+
+        # the store is not reused by later runs
+        collector.config.until = "2000-01-01"
+        ctx = collector.collect_metadata()
+        assert sum(len(each.commits) for each in ctx.files.values()) == 0
+
+
+def test_spill_roll_up_depths(tmp_path):
+    store = SpillStore((tmp_path / "spill.db").as_posix())
+    store.add_commit("c1", "add d")
+    store.add_commit("c2", "add c")
+    store.add_posting("a/d.py", "c1")
+    store.add_posting("a/b/c.py", "c2")
+
+    assert sorted(store.roll_up(["a/d.py", "a/b/c.py"], 1)) == ["a"]
+    assert sorted(store.roll_up(["a/d.py", "a/b/c.py"], -1)) == ["a", "a/b"]
+    assert store.count("a", 1) == 2
+    assert [each.hexsha for each in store.iter_commits("a", -1)] == ["c1"]
+    # file postings untouched
+    assert store.count("a") == 0
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from srctag.issue import iter_gh_issues, IssueIndex
+from srctag.model import SrcTagException
+from srctag.storage import Storage, StorageConfig
+
+issues = [
+    {"number": i, "title": f"title {i}, with [brackets] and \"quotes\"", "body": f"body {i}" if i % 2 else None}
+    for i in range(1, 200)
+]
+
+
+def test_iter_gh_issues(tmp_path):
+    json_file = tmp_path / "issues.json"
+    json_file.write_text(json.dumps(issues, indent=2))
+    jsonl_file = tmp_path / "issues.jsonl"
+    jsonl_file.write_text("\n".join(json.dumps(each) for each in issues))
+
+    # small chunks for covering the incremental parsing
+    assert list(iter_gh_issues(json_file.as_posix(), chunk_size=64)) == issues
+    assert list(iter_gh_issues(jsonl_file.as_posix(), chunk_size=64)) == issues
+
+
+def test_issue_index(tmp_path):
+    json_file = tmp_path / "issues.json"
+    json_file.write_text(json.dumps(issues))
+
+    index = IssueIndex.build_from_gh_dump(json_file.as_posix(), (tmp_path / "issues.db").as_posix())
+    assert len(index) == len(issues)
+    assert index.get("#3") == (issues[2]["title"], "body 3")
+    assert index.get("#999") is None
+    index.close()
+
+    storage = Storage(StorageConfig())
+    storage.config.load_issue_index_from_gh_dump(json_file.as_posix())
+    assert storage.config.has_issues()
+    assert storage.process_issue_id_to_title("#3") == issues[2]["title"]
+    assert storage.process_issue_id_to_title("#999") == ""
+
+    storage.config.issue_with_body = True
+    assert storage.process_issue_id_to_title("#3") == f'{issues[2]["title"]}\nbody 3'
+    assert storage.process_issue_id_to_title("#4") == issues[3]["title"]
+
+
+def test_issue_index_interrupted(tmp_path):
+    json_file = tmp_path / "issues.json"
+    # truncated dump, fails in the middle of building
+    json_file.write_text(json.dumps(issues)[:-100])
+    index_path = tmp_path / "issues.db"
+
+    with pytest.raises(SrcTagException):
+        IssueIndex.build_from_gh_dump(json_file.as_posix(), index_path.as_posix(), batch_size=10)
+    # no partial index to be reused
+    assert not index_path.exists()
+
+    json_file.write_text(json.dumps(issues))
+    index = IssueIndex.build_from_gh_dump(json_file.as_posix(), index_path.as_posix())
+    assert len(index) == len(issues)
+    index.close()
@@ -0,0 +1,27 @@
+import uuid
+
+from srctag.benchmark import BenchmarkConfig, HashEmbeddingFunction, generate_repo
+from srctag.multi import MultiRepoTagger
+from srctag.storage import StorageConfig
+
+
+def test_multi_repo(tmp_path):
+    repo_roots = []
+    for i in range(2):
+        repo_root = (tmp_path / f"repo_{i}").as_posix()
+        generate_repo(repo_root, BenchmarkConfig(file_count=10 + i, commit_count=30, seed=i))
+        repo_roots.append(repo_root)
+
+    storage_config = StorageConfig(collection_name=f"multi_{uuid.uuid4().hex}")
+    multi_tagger = MultiRepoTagger(storage_config=storage_config, embedding_function=HashEmbeddingFunction())
+    multi_tagger.tagger.config.tags = ["fix", "cache", "network"]
+    results = multi_tagger.tag(repo_roots)
+
+    assert set(results.keys()) == {"repo_0", "repo_1"}
+    assert len(results["repo_0"].files()) == 10
+    assert len(results["repo_1"].files()) == 11
+    assert len(multi_tagger.tagger.tag_embedding_store.data["HashEmbeddingFunction"]) == 3
+
+    combined = MultiRepoTagger.combine(results)
+    assert len(combined.files()) == 21
+    assert "repo_1/dir_0/file_10.py" in combined.files()
@@ -0,0 +1,52 @@
+import os
+
+import git
+
+from srctag.pathfilter import PathFilter, PatternSet
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_pattern_set():
+    patterns = PatternSet(["/srctag/", "tests/test_*.py", "*.md", "examples", "docs/", "**/workflows/*.yml"])
+    assert patterns.match("srctag/collector.py")
+    assert patterns.match("tests/test_api.py")
+    assert patterns.match("README.md")
+    assert patterns.match("a/b/README.md")
+    assert patterns.match("examples/read.py")
+    assert patterns.match("a/examples")
+    assert patterns.match("a/docs/x.txt")
+    assert patterns.match(".github/workflows/python-package.yml")
+
+    assert not patterns.match("srctag")
+    assert not patterns.match("a/srctag/collector.py")
+    assert not patterns.match("tests/conftest.py")
+    assert not patterns.match("a/tests/test_api.py")
+    assert not patterns.match("docs")
+    assert not patterns.match("pyproject.toml")
+
+
+def test_path_filter():
+    path_filter = PathFilter(["srctag/", "tests/"], ["tests/test_api.py", "__init__.py"], include_regex=r".*\.py")
+    assert path_filter.match("srctag/tagger.py")
+    assert path_filter.match("tests/test_cli.py")
+    assert not path_filter.match("tests/test_api.py")
+    assert not path_filter.match("srctag/__init__.py")
+    assert not path_filter.match("examples/read.py")
+
+
+def test_pattern_file(tmp_path):
+    pattern_file = tmp_path / "CODEOWNERS"
+    pattern_file.write_text("# owners\n/srctag/ @someone\n*.md @docs\n!README.md\n")
+    include, exclude = PathFilter.load_pattern_file(pattern_file.as_posix())
+    assert include == ["/srctag/", "*.md"]
+    assert exclude == ["README.md"]
+
+
+def test_pathspecs():
+    # pushing down to git should give the same result as matching in python
+    path_filter = PathFilter(["srctag/", "*.py", ".github/**/*.yml"], ["tests/test_api.py", "__init__.py"])
+    git_repo = git.Repo(repo_root)
+    all_files = git_repo.git.ls_files("-z").split("\0")
+    pushed_down = git_repo.git.ls_files("-z", "--", *path_filter.to_pathspecs()).split("\0")
+    assert set(each for each in pushed_down if each) == set(each for each in all_files if each and path_filter.match(each))
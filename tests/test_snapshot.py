@@ -0,0 +1,49 @@
+import os
+
+from srctag.profile import ProfileStage
+from srctag.snapshot import save_snapshot, snapshot_path, has_snapshot
+from srctag.model import RuntimeContext
+from srctag.storage import Storage, StorageConfig, StorageBackendEnum
+
+
+def _tiny_model(path: str) -> str:
+    """ a random tiny bert, no downloading """
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    os.makedirs(path)
+    vocab_file = os.path.join(path, "vocab.txt")
+    with open(vocab_file, "w") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "fix", "add", "cache", "doc"]))
+    BertTokenizerFast(vocab_file).save_pretrained(path)
+    config = BertConfig(vocab_size=9, hidden_size=8, num_hidden_layers=1, num_attention_heads=1, intermediate_size=8)
+    BertModel(config).save_pretrained(path)
+
+    transformer = models.Transformer(path)
+    pooling = models.Pooling(transformer.get_word_embedding_dimension())
+    SentenceTransformer(modules=[transformer, pooling], device="cpu").save(os.path.join(path, "st"))
+    return os.path.join(path, "st")
+
+
+def test_snapshot(tmp_path):
+    model_name = _tiny_model((tmp_path / "origin").as_posix())
+    cache_dir = (tmp_path / "cache").as_posix()
+
+    config = StorageConfig(st_model_name=model_name, model_cache_dir=cache_dir)
+    assert Storage(config).model_source() == model_name
+
+    path = save_snapshot(model_name, snapshot_path(model_name, cache_dir))
+    assert has_snapshot(path)
+    assert any(each.endswith(".safetensors") for each in os.listdir(path))
+
+    storage = Storage(config)
+    assert storage.model_source() == path
+    storage.init_embedding_function()
+    assert len(storage.embedding_function(["fix cache"])[0]) == 8
+    assert storage.profile.stages[ProfileStage.MODEL_LOADING].calls == 1
+
+    # model loading is profiled into the ctx
+    ctx = RuntimeContext()
+    storage = Storage(StorageConfig(st_model_name=path, backend=StorageBackendEnum.NUMPY))
+    storage.embed_ctx(ctx)
+    assert ctx.profile.stages[ProfileStage.MODEL_LOADING].calls == 1
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from srctag.benchmark import HashEmbeddingFunction
+from srctag.checkpoint import CheckpointJournal
+from srctag.collector import Collector
+from srctag.storage import Storage, StorageConfig, StorageBackendEnum
+
+
+class InterruptedEmbeddingFunction(HashEmbeddingFunction):
+    def __init__(self, limit: int = -1):
+        super().__init__()
+        self.limit = limit
+        self.embedded = 0
+
+    def __call__(self, input):
+        if 0 <= self.limit <= self.embedded:
+            raise KeyboardInterrupt("preempted")
+        self.embedded += len(input)
+        return super().__call__(input)
+
+
+def test_resume_from_checkpoint(tmp_path):
+    collector = Collector()
+    collector.config.repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ctx = collector.collect_metadata()
+
+    expected = Storage(embedding_function=HashEmbeddingFunction(), config=StorageConfig(
+        collection_name="expected", backend=StorageBackendEnum.NUMPY
+    ))
+    expected.embed_ctx(ctx)
+    total = expected.doc_count()
+
+    for each_backend in StorageBackendEnum:
+        db_path = (tmp_path / each_backend.value).as_posix()
+        storage_config = StorageConfig(db_path=db_path, backend=each_backend, write_batch_size=8)
+        journal_path = CheckpointJournal.path_of(db_path)
+
+        # after some flushes, whatever the file order is
+        interrupted = InterruptedEmbeddingFunction(limit=total // 2)
+        with pytest.raises(KeyboardInterrupt):
+            Storage(storage_config, embedding_function=interrupted).embed_ctx(ctx)
+        journal = CheckpointJournal(journal_path)
+        assert journal.file_count() > 0
+        journal.close()
+
+        resumed = InterruptedEmbeddingFunction()
+        storage = Storage(storage_config, embedding_function=resumed)
+        storage.embed_ctx(ctx)
+        assert storage.doc_count() == total
+        assert resumed.embedded < total
+        assert not os.path.isfile(journal_path)
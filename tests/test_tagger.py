@@ -0,0 +1,156 @@
+import itertools
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from srctag.benchmark import HashEmbeddingFunction, BenchmarkConfig, generate_repo
+from srctag.collector import Collector
+from srctag.scores import SparseScores
+from srctag.storage import Storage, StorageConfig, MetadataConstant, StorageBackendEnum
+from srctag.tagger import Tagger, TagEmbeddingStore
+
+
+def test_tag_embedding_store(tmp_path):
+    collector = Collector()
+    collector.config.repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ctx = collector.collect_metadata()
+
+    db_path = (tmp_path / "db").as_posix()
+    storage_config = StorageConfig(db_path=db_path, collection_name=f"test_{uuid.uuid4().hex}")
+    storage = Storage(storage_config, embedding_function=HashEmbeddingFunction())
+    storage.embed_ctx(ctx)
+
+    tagger = Tagger()
+    tagger.config.tags = ["storage", "tag"]
+    tag_result = tagger.tag(storage)
+
+    store = TagEmbeddingStore(TagEmbeddingStore.path_of(db_path))
+    assert set(store.data["HashEmbeddingFunction"].keys()) == {"storage", "tag"}
+
+    # precomputed vectors
+    tag_embeddings = tagger.embed_tags(storage)
+    precomputed_result = tagger.tag_with_embeddings(storage, tag_embeddings)
+    assert precomputed_result.scores_df.equals(tag_result.scores_df)
+
+
+def test_fused(tmp_path):
+    repo_root = (tmp_path / "repo").as_posix()
+    generate_repo(repo_root, BenchmarkConfig(file_count=20, commit_count=60, files_per_commit=1, issue_density=0.9))
+
+    collector = Collector()
+    collector.config.repo_root = repo_root
+    ctx = collector.collect_metadata()
+
+    storage_config = StorageConfig(collection_name=f"test_{uuid.uuid4().hex}")
+    storage_config.issue_mapping = {f"#{i}": f"issue {i} about cache" for i in range(1, 101)}
+    storage = Storage(storage_config, embedding_function=HashEmbeddingFunction())
+    storage.embed_ctx(ctx)
+
+    tagger = Tagger()
+    tagger.config.tags = ["fix cache", "network", "login"]
+    tagger.config.fused = True
+    tagger.config.issue_weight = 0.5
+    tag_result = tagger.tag(storage)
+
+    assert len(tag_result.tags()) == 3
+    assert len(tag_result.files()) == 20
+    tag_nodes = [x for x, y in storage.relations.nodes(data=True) if y["node_type"] == MetadataConstant.KEY_TAG]
+    assert len(tag_nodes) == 3
+
+
+def test_spill(tmp_path):
+    repo_root = (tmp_path / "repo").as_posix()
+    generate_repo(repo_root, BenchmarkConfig(file_count=20, commit_count=60, files_per_commit=2, issue_density=0.9))
+
+    result = []
+    for spill_path in ("", (tmp_path / "spill.db").as_posix()):
+        collector = Collector()
+        collector.config.repo_root = repo_root
+        collector.config.spill_path = spill_path
+        ctx = collector.collect_metadata()
+
+        storage_config = StorageConfig(collection_name=f"test_{uuid.uuid4().hex}", backend=StorageBackendEnum.NUMPY)
+        storage_config.issue_mapping = {f"#{i}": f"issue {i} about cache" for i in range(1, 101)}
+        storage = Storage(storage_config, embedding_function=HashEmbeddingFunction())
+        storage.embed_ctx(ctx)
+
+        tagger = Tagger()
+        tagger.config.tags = ["fix cache", "network", "login"]
+        tagger.config.fused = True
+        result.append((storage.doc_count(), tagger.tag(storage).scores_df))
+    assert result[0][0] == result[1][0]
+    pd.testing.assert_frame_equal(result[0][1].sort_index(), result[1][1].sort_index())
+
+
+def _dense_optimize(df: pd.DataFrame) -> pd.DataFrame:
+    """ the dense version of SparseScores.optimize """
+    df = np.exp(df * 2.0)
+    row_variances = df.var(axis=1)
+    weights = 1.0 - row_variances / row_variances.max()
+    return df.multiply(weights, axis=0)
+
+
+def test_sparse_post_process():
+    rng = np.random.default_rng(0)
+    data = dict()
+    for i in range(300):
+        tags = rng.choice(20, size=rng.integers(1, 12), replace=False)
+        # rounded, for ties
+        data[f"file{i}"] = {f"tag{j}": float(np.round(rng.random() * 3, 1)) for j in tags}
+    # same scores in different tag order
+    data["file_reversed"] = dict(reversed(list(data["file0"].items())))
+
+    for optimize, normalize in itertools.product((False, True), (False, True)):
+        tagger = Tagger()
+        tagger.config.optimize = optimize
+        tagger.config.normalize = normalize
+
+        # dense pipeline
+        expected = pd.DataFrame.from_dict(data, orient="index")
+        if optimize:
+            expected = _dense_optimize(expected)
+        expected = expected.rank(axis=0, method="min")
+        if normalize:
+            expected = (expected - expected.min()) / (expected.max() - expected.min())
+
+        actual = tagger._post_process(SparseScores.from_nested_dict(data))
+        pd.testing.assert_frame_equal(actual, expected)
+
+        tagger.config.sparse_output = True
+        actual = tagger._post_process(SparseScores.from_nested_dict(data))
+        pd.testing.assert_frame_equal(actual.sparse.to_dense(), expected)
+
+
+def test_optimize_hook():
+    class ReversedTagger(Tagger):
+        def optimize(self, scores: SparseScores) -> SparseScores:
+            scores.values = -scores.values
+            return scores
+
+    data = {"a.py": {"tag": 1.0}, "b.py": {"tag": 2.0}}
+    tagger = ReversedTagger()
+    tagger.config.optimize = True
+    tagger.config.normalize = False
+    assert tagger._post_process(SparseScores.from_nested_dict(data))["tag"].to_dict() == {"a.py": 2.0, "b.py": 1.0}
+
+
+def test_tag_files(tmp_path):
+    collector = Collector()
+    collector.config.repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ctx = collector.collect_metadata()
+    files = ["srctag/tagger.py", "srctag/storage.py", "not/exist.py"]
+
+    for each_backend in StorageBackendEnum:
+        storage_config = StorageConfig(db_path=(tmp_path / each_backend.value).as_posix(), backend=each_backend)
+        Storage(storage_config, embedding_function=HashEmbeddingFunction()).embed_ctx(ctx)
+
+        # a new storage loaded from db_path, without collecting
+        storage = Storage(storage_config, embedding_function=HashEmbeddingFunction())
+        tagger = Tagger()
+        tagger.config.tags = ["storage", "tag", "profile"]
+        tag_result = tagger.tag_files(storage, files)
+
+        assert set(tag_result.files()) == set(files[:2])
+        assert tag_result.scores_df.max().max() <= 1.0
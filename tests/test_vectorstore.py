@@ -0,0 +1,145 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from srctag.benchmark import HashEmbeddingFunction
+from srctag.collector import Collector
+from srctag.storage import Storage, StorageConfig, StorageBackendEnum, MetadataConstant
+from srctag.tagger import Tagger
+from srctag.vectorstore import NumpyCollection
+
+
+def _fill(collection: NumpyCollection, vectors: np.ndarray):
+    collection.add(
+        ids=[f"doc{i}" for i in range(len(vectors))],
+        embeddings=vectors.tolist(),
+        metadatas=[{"kind": "even" if i % 2 == 0 else "odd"} for i in range(len(vectors))],
+        documents=[f"document {i}" for i in range(len(vectors))],
+    )
+
+
+def test_numpy_collection(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(500, 16)).astype(np.float32)
+    queries = rng.normal(size=(4, 16)).astype(np.float32)
+
+    collection = NumpyCollection("test", path=tmp_path.as_posix())
+    _fill(collection, vectors)
+    assert collection.count() == 500
+    assert len(collection.get(where={"kind": "odd"}, include=[])["ids"]) == 250
+
+    result = collection.query(queries.tolist(), n_results=10, where={"kind": {"$in": ["even"]}})
+    for each_query, each_ids, each_distances in zip(queries, result["ids"], result["distances"]):
+        expected = ((vectors[::2] - each_query) ** 2).sum(axis=1)
+        assert each_ids == [f"doc{i * 2}" for i in np.argsort(expected)[:10]]
+        assert np.allclose(each_distances, np.sort(expected)[:10], rtol=1e-4)
+    assert all(each["kind"] == "even" for each in result["metadatas"][0])
+
+    collection.upsert(ids=["doc0"], embeddings=[queries[0].tolist()], metadatas=[{"kind": "even"}])
+    collection.save()
+
+    loaded = NumpyCollection("test", path=tmp_path.as_posix())
+    assert loaded.count() == 500
+    assert loaded.query([queries[0].tolist()], n_results=1)["ids"] == [["doc0"]]
+    assert loaded.get(ids=["doc3"])["documents"] == ["document 3"]
+
+    # save again without writes, embeddings are mapped from the same file
+    expected_sum = float(np.asarray(loaded.embeddings).sum())
+    loaded.save()
+    reloaded = NumpyCollection("test", path=tmp_path.as_posix())
+    assert float(np.asarray(reloaded.embeddings).sum()) == expected_sum
+    assert reloaded.count() == 500
+
+
+def test_numpy_collection_segments(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(300, 16)).astype(np.float32)
+
+    collection = NumpyCollection("test", path=tmp_path.as_posix())
+    for start in range(0, 300, 100):
+        collection.add(
+            ids=[f"doc{i}" for i in range(start, start + 100)],
+            embeddings=vectors[start: start + 100].tolist(),
+            metadatas=[{"batch": start} if start else dict() for _ in range(100)],
+        )
+        collection.save()
+        # only new rows appended
+        assert collection.get(ids=[f"doc{start}"])["ids"]
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        ["test.json"] + [f"test.{i}.{ext}" for i in range(3) for ext in ("npy", "json")]
+    )
+
+    loaded = NumpyCollection("test", path=tmp_path.as_posix())
+    assert loaded.count() == 300
+    assert np.allclose(loaded.embeddings, vectors)
+    assert loaded.get(ids=["doc0", "doc250"])["metadatas"] == [dict(), {"batch": 200}]
+
+    # saved rows changed, rewritten into one segment
+    loaded.upsert(ids=["doc1"], embeddings=[vectors[0].tolist()])
+    loaded.save()
+    assert sorted(os.listdir(tmp_path)) == ["test.3.json", "test.3.npy", "test.json"]
+    reloaded = NumpyCollection("test", path=tmp_path.as_posix())
+    assert np.allclose(reloaded.embeddings[1], vectors[0])
+    assert reloaded.get(ids=["doc1"])["metadatas"] == [dict()]
+
+    reloaded.add(ids=["new"], embeddings=[vectors[0].tolist()])
+    reloaded.save(compact=True)
+    assert sorted(os.listdir(tmp_path)) == ["test.4.json", "test.4.npy", "test.json"]
+    assert NumpyCollection("test", path=tmp_path.as_posix()).count() == 301
+
+
+def test_numpy_collection_ivf():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(2000, 16)).astype(np.float32)
+    queries = rng.normal(size=(8, 16)).astype(np.float32)
+
+    exact = NumpyCollection("exact")
+    ivf = NumpyCollection("ivf", nlist=16, nprobe=4)
+    _fill(exact, vectors)
+    _fill(ivf, vectors)
+
+    exact_ids = exact.query(queries.tolist(), n_results=10)["ids"]
+    ivf_ids = ivf.query(queries.tolist(), n_results=10)["ids"]
+    recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(exact_ids, ivf_ids)])
+    assert recall > 0.6
+
+    # probe more lists for large n_results
+    assert all(len(each) == 1500 for each in ivf.query(queries.tolist(), n_results=1500)["ids"])
+
+
+def test_numpy_backend(tmp_path):
+    collector = Collector()
+    collector.config.repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ctx = collector.collect_metadata()
+
+    db_path = (tmp_path / "db").as_posix()
+    storage_config = StorageConfig(db_path=db_path, backend=StorageBackendEnum.NUMPY)
+    storage = Storage(storage_config, embedding_function=HashEmbeddingFunction())
+    storage.embed_ctx(ctx)
+
+    tagger = Tagger()
+    tagger.config.tags = ["storage", "tag"]
+    tag_result = tagger.tag(storage)
+    assert len(tag_result.tags()) == 2
+    tag_nodes = [x for x, y in storage.relations.nodes(data=True) if y["node_type"] == MetadataConstant.KEY_TAG]
+    assert len(tag_nodes) == 2
+
+    # loaded from files
+    loaded = Storage(storage_config, embedding_function=HashEmbeddingFunction())
+    assert loaded.doc_count() == storage.doc_count()
+
+
+def test_numpy_backend_without_chromadb(tmp_path):
+    # a fresh interpreter, chromadb is already imported by other tests here
+    script = f"""
+import sys
+from srctag.benchmark import HashEmbeddingFunction
+from srctag.storage import Storage, StorageConfig, StorageBackendEnum
+storage = Storage(StorageConfig(db_path={tmp_path.as_posix()!r}, backend=StorageBackendEnum.NUMPY),
+                  embedding_function=HashEmbeddingFunction())
+assert storage.doc_count() == 0
+assert "chromadb" not in sys.modules
+"""
+    subprocess.run([sys.executable, "-c", script], check=True)